@@ -21,16 +21,919 @@ Ampache XML and JSON Api 420000 for python3
  along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+import asyncio
+import codecs
+import functools
+import gzip
 import hashlib
+import itertools
 import json
 import os
+import random
+import re
 import requests
+import requests.adapters
+import sys
+import threading
 import time
+import types
 import urllib.parse
-import urllib.request
-
+import urllib3.connection
+import urllib3.connectionpool
+import urllib3.exceptions
+
+from array import array
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from xml.etree import ElementTree
 
+# seconds a read-only action can be served from the response cache
+CACHE_TTLS = {'artists': 300, 'artist': 300, 'artist_albums': 300, 'artist_songs': 300,
+              'albums': 300, 'album': 300, 'album_songs': 300,
+              'genres': 600, 'genre': 600, 'genre_artists': 600, 'genre_albums': 600, 'genre_songs': 600,
+              'songs': 300, 'song': 300, 'url_to_song': 300, 'get_indexes': 300,
+              'search_songs': 120, 'advanced_search': 120,
+              'playlists': 60, 'playlist': 60, 'playlist_songs': 60,
+              'podcasts': 300, 'podcast': 300, 'podcast_episodes': 300, 'podcast_episode': 300,
+              'videos': 300, 'video': 300, 'shares': 60, 'share': 60,
+              'catalogs': 3600, 'catalog': 3600, 'users': 300, 'user': 300,
+              'licenses': 3600, 'license': 3600, 'license_songs': 3600,
+              'labels': 3600, 'label': 3600, 'label_artists': 3600,
+              'user_preferences': 300, 'user_preference': 300,
+              'system_preferences': 300, 'system_preference': 300}
+
+# actions that change the server and the (object_type, id parameter) they change
+# an object_type of None reads the type parameter, an id parameter of None means any object
+CACHE_MUTATIONS = {'playlist_create': [('playlist', None)],
+                   'playlist_edit': [('playlist', 'filter')],
+                   'playlist_delete': [('playlist', 'filter')],
+                   'playlist_add_song': [('playlist', 'filter')],
+                   'playlist_remove_song': [('playlist', 'filter')],
+                   'song_delete': [('song', 'filter')],
+                   'rate': [(None, 'id')],
+                   'flag': [(None, 'id')],
+                   'record_play': [('song', 'id')],
+                   'scrobble': [('song', None)],
+                   'update_from_tags': [(None, 'id')],
+                   'update_art': [(None, 'id')],
+                   'update_artist_info': [('artist', 'id')],
+                   'podcast_create': [('podcast', None)],
+                   'podcast_edit': [('podcast', 'filter')],
+                   'podcast_delete': [('podcast', 'filter')],
+                   'update_podcast': [('podcast', 'filter')],
+                   'podcast_episode_delete': [('podcast_episode', 'filter')],
+                   'share_create': [('share', None)],
+                   'share_edit': [('share', 'filter')],
+                   'share_delete': [('share', 'filter')],
+                   'user_create': [('user', None)],
+                   'user_update': [('user', None)],
+                   'user_delete': [('user', None)],
+                   'preference_create': [('user_preference', None), ('system_preference', None)],
+                   'preference_edit': [('user_preference', None), ('system_preference', None)],
+                   'preference_delete': [('user_preference', None), ('system_preference', None)],
+                   'catalog_action': [(False, None)],
+                   'catalog_file': [(False, None)],
+                   'system_update': [(False, None)]}
+
+# uncached actions that only read from the server, these are shared between concurrent callers too
+SHARED_ACTIONS = {'ping', 'stats', 'tags', 'tag', 'tag_artists', 'tag_albums', 'tag_songs', 'get_similar',
+                  'followers', 'following', 'last_shouts', 'timeline', 'friends_timeline', 'localplay_songs'}
+# actions that only read for one value of a parameter e.g. localplay(command='status')
+SHARED_COMMANDS = {'localplay': ('command', 'status'), 'democratic': ('method', 'playlist')}
+
+# error codes for a session the server has rejected (expired or invalid)
+AUTH_ERRORS = ('401', '4701')
+
+# request classes for the RequestLimiter, any other action is 'bulk'
+LIMITER_CLASSES = {'handshake': 'control', 'ping': 'control', 'goodbye': 'control',
+                   'localplay': 'control', 'localplay_songs': 'control', 'democratic': 'control',
+                   'stream': 'download', 'download': 'download', 'get_art': 'download'}
+# rate = requests per second (0 for no rate limit), burst = bucket size, limit = starting concurrency
+# (min_limit to max_limit), latency = seconds (to the response headers) above which concurrency is reduced,
+# 0 only reduces on errors. control isn't rate limited so a playlist can be added to localplay quickly
+LIMITER_SETTINGS = {'control': {'rate': 0, 'burst': 10, 'limit': 4, 'min_limit': 1, 'max_limit': 8, 'latency': 2},
+                    'bulk': {'rate': 10, 'burst': 10, 'limit': 4, 'min_limit': 1, 'max_limit': 10, 'latency': 5},
+                    'download': {'rate': 5, 'burst': 5, 'limit': 2, 'min_limit': 1, 'max_limit': 4, 'latency': 0}}
+
+
+class PageError(ConnectionError):
+    """ PageError
+
+        Raised by the paging generators when a page still fails after its retries,
+        so a failed request can't be mistaken for the end of the list.
+        error is the api error code of the failure (e.g. '4701') or False when there wasn't one.
+    """
+
+    def __init__(self, message: str, error=False):
+        super().__init__(message)
+        self.error = error
+
+
+class ResponseCache(object):
+    """ ResponseCache
+
+        In-memory LRU cache of raw api responses for read-only actions.
+        Entries are keyed on the server, action and parameters (without auth)
+        and expire after the action's TTL or when the memory budget is full.
+    """
+
+    def __init__(self, max_bytes: int = 16777216, ttls: dict = None):
+        self.max_bytes = max_bytes
+        self.ttls = dict(CACHE_TTLS)
+        if ttls:
+            self.ttls.update(ttls)
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = dict()
+        self.misses = dict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def get_key(full_url: str):
+        """ get_key
+
+            return (key, action, params) for a request url
+
+            INPUTS
+            * full_url = (string) url to fetch
+        """
+        url = urllib.parse.urlsplit(full_url)
+        params = dict(urllib.parse.parse_qsl(url.query))
+        params.pop('auth', None)
+        action = params.pop('action', '')
+        key = (url.netloc + url.path, action, tuple(sorted(params.items())))
+        return key, action, params
+
+    @staticmethod
+    def is_error(response: bytes):
+        """ is_error
+
+            return True for an error response (these are never cached)
+        """
+        return bool(re.match(rb'\s*{\s*"error"\s*:', response) or
+                    re.search(rb'<root>\s*<error[\s>]', response[:512]))
+
+    def get(self, key, action: str):
+        """ get
+
+            return the cached response for a key or False if it's missing or stale
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry[0] < time.monotonic():
+                self.remove(key)
+                entry = None
+            if not entry:
+                self.misses[action] = self.misses.get(action, 0) + 1
+                return False
+            self.entries.move_to_end(key)
+            self.hits[action] = self.hits.get(action, 0) + 1
+            return entry[2]
+
+    def set(self, key, action: str, params: dict, response: bytes):
+        """ set
+
+            store a response, evicting the least recently used entries to stay in budget
+        """
+        if not self.ttls.get(action) or len(response) > self.max_bytes or self.is_error(response):
+            return
+        with self.lock:
+            if key in self.entries:
+                self.remove(key)
+            self.entries[key] = (time.monotonic() + self.ttls[action], params, response)
+            self.size += len(response)
+            while self.size > self.max_bytes:
+                self.remove(next(iter(self.entries)))
+
+    def remove(self, key):
+        """ remove
+
+            drop one entry (call while holding the lock)
+        """
+        entry = self.entries.pop(key)
+        self.size -= len(entry[2])
+
+    def invalidate(self, object_type=False, object_id=None):
+        """ invalidate
+
+            drop entries that could include an object. A single object action is only dropped
+            for the matching filter, any list of that object type is always dropped.
+
+            INPUTS
+            * object_type = (string) e.g. 'playlist', 'song'. False clears everything //optional
+            * object_id   = (string) the object's id, None for any object //optional
+        """
+        with self.lock:
+            for key in list(self.entries):
+                action = key[1]
+                params = self.entries[key][1]
+                if object_type:
+                    if action == object_type or action.startswith(object_type + '_'):
+                        if object_id is not None and params.get('filter') != str(object_id):
+                            continue
+                    elif not (action == object_type + 's' or action.endswith('_' + object_type + 's') or
+                              params.get('type') == object_type):
+                        continue
+                self.remove(key)
+
+    def mutated(self, action: str, params: dict):
+        """ mutated
+
+            invalidate everything a mutating action may have changed
+        """
+        for object_type, id_param in CACHE_MUTATIONS.get(action, []):
+            if object_type is None:
+                object_type = params.get('type', '').lower()
+            self.invalidate(object_type, params.get(id_param) if id_param else None)
+
+    def clear(self):
+        """ clear
+
+            drop every entry
+        """
+        self.invalidate(False)
+
+    def stats(self):
+        """ stats
+
+            return the hit and miss counters and current memory use
+        """
+        with self.lock:
+            return {'hits': sum(self.hits.values()),
+                    'misses': sum(self.misses.values()),
+                    'entries': len(self.entries),
+                    'bytes': self.size,
+                    'actions': {action: {'hits': self.hits.get(action, 0), 'misses': self.misses.get(action, 0)}
+                                for action in set(self.hits) | set(self.misses)}}
+
+
+class RequestLimiter(object):
+    """ RequestLimiter
+
+        Token bucket rate limit and adaptive (AIMD) concurrency limit for each class of action.
+        Concurrency grows by one for every `limit` successful requests and halves after an error
+        or a slow response. Background requests wait while a control request is waiting.
+    """
+
+    def __init__(self, settings: dict = None):
+        self.settings = {name: dict(values) for name, values in LIMITER_SETTINGS.items()}
+        for name, values in (settings or dict()).items():
+            self.settings[name].update(values)
+        now = time.monotonic()
+        self.tokens = {name: float(values['burst']) for name, values in self.settings.items()}
+        self.updated = {name: now for name in self.settings}
+        self.limits = {name: float(values['limit']) for name, values in self.settings.items()}
+        self.reduced = {name: 0.0 for name in self.settings}
+        self.active = {name: 0 for name in self.settings}
+        self.waiting = {name: 0 for name in self.settings}
+        self.errors = {name: 0 for name in self.settings}
+        self.condition = threading.Condition()
+
+    @staticmethod
+    def get_class(action: str):
+        return LIMITER_CLASSES.get(action, 'bulk')
+
+    def acquire(self, action: str):
+        """ acquire
+
+            wait for a token and a free slot for an action
+        """
+        name = self.get_class(action)
+        settings = self.settings[name]
+        with self.condition:
+            self.waiting[name] += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    self.tokens[name] = min(settings['burst'],
+                                            self.tokens[name] + (now - self.updated[name]) * settings['rate'])
+                    self.updated[name] = now
+                    ready = name == 'control' or not self.waiting['control']
+                    tokens = self.tokens[name] >= 1 or not settings['rate']
+                    if ready and self.active[name] < int(self.limits[name]) and tokens:
+                        self.tokens[name] = max(0, self.tokens[name] - 1)
+                        self.active[name] += 1
+                        return name
+                    # wake up when the next token is due or a slot is released
+                    if settings['rate']:
+                        self.condition.wait(max((1 - self.tokens[name]) / settings['rate'], 0.01))
+                    else:
+                        self.condition.wait(0.1)
+            finally:
+                self.waiting[name] -= 1
+
+    def release(self, action: str, success: bool = True, elapsed: float = 0):
+        """ release
+
+            free the slot for an action and adjust the concurrency limit from the result
+
+            INPUTS
+            * action  = (string) api action
+            * success = (boolean) False for connection errors and server overload
+            * elapsed = (float) seconds to the response headers
+        """
+        name = self.get_class(action)
+        settings = self.settings[name]
+        with self.condition:
+            self.active[name] -= 1
+            now = time.monotonic()
+            if not success or (settings['latency'] and elapsed > settings['latency']):
+                self.errors[name] += not success
+                # only back off once for a burst of failures
+                if now - self.reduced[name] > 1:
+                    self.limits[name] = max(settings['min_limit'], self.limits[name] / 2)
+                    self.reduced[name] = now
+            else:
+                self.limits[name] = min(settings['max_limit'], self.limits[name] + 1 / self.limits[name])
+            self.condition.notify_all()
+
+    def stats(self):
+        """ stats
+
+            return the current limit, active and waiting requests and errors for each class
+        """
+        with self.condition:
+            return {name: {'limit': int(self.limits[name]), 'active': self.active[name],
+                           'waiting': self.waiting[name], 'errors': self.errors[name]} for name in self.settings}
+
+
+# request parameters left out of traces
+TRACE_SCRUB = ('auth', 'user', 'username', 'password', 'email', 'timestamp')
+# the session inside url parameters (e.g. url_to_song), as a query parameter or a /ssid/ path part
+TRACE_SCRUB_URL = re.compile(r'((?:^|[?&;/])(?:auth|ssid)[=/])[^&;/]*')
+# upper bounds (seconds) of the latency histogram buckets
+METRIC_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+METRIC_PHASES = ('connect', 'ttfb', 'parse')
+# seconds spent opening connections by the current thread, see TimedHTTPConnection
+CONNECT_STATE = threading.local()
+
+
+class TimedHTTPConnection(urllib3.connection.HTTPConnection):
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            super().connect()
+        finally:
+            CONNECT_STATE.seconds = getattr(CONNECT_STATE, 'seconds', 0) + time.perf_counter() - started
+
+
+class TimedHTTPSConnection(urllib3.connection.HTTPSConnection):
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            super().connect()
+        finally:
+            CONNECT_STATE.seconds = getattr(CONNECT_STATE, 'seconds', 0) + time.perf_counter() - started
+
+
+class TimedHTTPConnectionPool(urllib3.connectionpool.HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(urllib3.connectionpool.HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+class RequestMetrics(object):
+    """ RequestMetrics
+
+        Per action request and error counts, bytes in/out and latency histograms for
+        connect (new connections only), ttfb (request sent to response headers) and parse time.
+    """
+
+    def __init__(self, buckets=METRIC_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.actions = dict()
+        self.lock = threading.Lock()
+
+    def get_action(self, action: str):
+        entry = self.actions.get(action)
+        if entry is None:
+            entry = self.actions[action] = {'requests': 0, 'errors': 0, 'bytes_in': 0, 'bytes_out': 0}
+            for phase in METRIC_PHASES:
+                entry[phase] = {'buckets': [0] * (len(self.buckets) + 1), 'sum': 0.0, 'count': 0}
+        return entry
+
+    def add_time(self, entry: dict, phase: str, seconds: float):
+        histogram = entry[phase]
+        index = 0
+        while index < len(self.buckets) and seconds > self.buckets[index]:
+            index += 1
+        histogram['buckets'][index] += 1
+        histogram['sum'] += seconds
+        histogram['count'] += 1
+
+    def record(self, action: str, success: bool, bytes_in: int = 0, bytes_out: int = 0,
+               connect: float = 0, ttfb: float = 0):
+        """ record
+
+            record one http request, connect is 0 when a pooled connection was reused
+        """
+        with self.lock:
+            entry = self.get_action(action)
+            entry['requests'] += 1
+            entry['errors'] += not success
+            entry['bytes_in'] += bytes_in
+            entry['bytes_out'] += bytes_out
+            if connect:
+                self.add_time(entry, 'connect', connect)
+            if success:
+                self.add_time(entry, 'ttfb', ttfb)
+
+    def add_error(self, action: str):
+        """ add_error
+
+            count an error response from the api (the http request itself succeeded)
+        """
+        with self.lock:
+            self.get_action(action)['errors'] += 1
+
+    def observe(self, action: str, phase: str, seconds: float):
+        with self.lock:
+            self.add_time(self.get_action(action), phase, seconds)
+
+    def snapshot(self):
+        """ snapshot
+
+            return a copy of the metrics {action: {'requests', 'errors', 'bytes_in', 'bytes_out',
+            'connect'|'ttfb'|'parse': {'buckets', 'sum', 'count'}}} with 'buckets' listed first
+        """
+        with self.lock:
+            result = {'buckets': list(self.buckets)}
+            for action, entry in self.actions.items():
+                result[action] = dict(entry)
+                for phase in METRIC_PHASES:
+                    result[action][phase] = dict(entry[phase], buckets=list(entry[phase]['buckets']))
+            return result
+
+    def reset(self):
+        with self.lock:
+            self.actions = dict()
+
+    def get_prometheus(self):
+        """ get_prometheus
+
+            return the metrics in the prometheus text exposition format
+        """
+        snapshot = self.snapshot()
+        buckets = snapshot.pop('buckets')
+        lines = []
+        for name, key, kind, text in (('ampache_requests_total', 'requests', 'counter', 'HTTP requests sent'),
+                                      ('ampache_errors_total', 'errors', 'counter', 'Failed requests and api errors'),
+                                      ('ampache_received_bytes_total', 'bytes_in', 'counter', 'Response body bytes'),
+                                      ('ampache_sent_bytes_total', 'bytes_out', 'counter', 'Request url bytes')):
+            lines.append('# HELP ' + name + ' ' + text)
+            lines.append('# TYPE ' + name + ' ' + kind)
+            for action in sorted(snapshot):
+                lines.append(name + '{action="' + action + '"} ' + str(snapshot[action][key]))
+        name = 'ampache_request_seconds'
+        lines.append('# HELP ' + name + ' Request latency by phase (connect, ttfb, parse)')
+        lines.append('# TYPE ' + name + ' histogram')
+        for action in sorted(snapshot):
+            for phase in METRIC_PHASES:
+                histogram = snapshot[action][phase]
+                labels = 'action="' + action + '",phase="' + phase + '"'
+                total = 0
+                for bound, count in zip(list(buckets) + ['+Inf'], histogram['buckets']):
+                    total += count
+                    lines.append(name + '_bucket{' + labels + ',le="' + str(bound) + '"} ' + str(total))
+                lines.append(name + '_sum{' + labels + '} ' + repr(histogram['sum']))
+                lines.append(name + '_count{' + labels + '} ' + str(histogram['count']))
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path: str):
+        """ write_prometheus
+
+            write the metrics to a file for the node_exporter textfile collector (replaced atomically)
+        """
+        temp = path + '.tmp'
+        with open(temp, 'w', encoding='utf-8') as metrics_file:
+            metrics_file.write(self.get_prometheus())
+        os.replace(temp, path)
+
+
+class CircuitBreaker(object):
+    """ CircuitBreaker
+
+        Fail fast after `threshold` failed requests in a row (open) and let one probe
+        request through every `reset_timeout` seconds (half_open) until one succeeds (closed).
+    """
+
+    def __init__(self, threshold: int = 5, reset_timeout: float = 30):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self.failures = 0
+        self.opened = 0.0
+        self.rejected = 0
+        self.lock = threading.Lock()
+
+    def allow(self):
+        """ allow
+
+            return True when a request can be sent
+        """
+        with self.lock:
+            if self.state == 'closed':
+                return True
+            now = time.monotonic()
+            if now - self.opened >= self.reset_timeout:
+                # probe the server, other requests keep failing until it answers
+                self.state = 'half_open'
+                self.opened = now
+                return True
+            self.rejected += 1
+            return False
+
+    def record(self, success: bool):
+        """ record
+
+            record the result of a request that allow() let through
+        """
+        with self.lock:
+            if success:
+                self.state = 'closed'
+                self.failures = 0
+                return
+            self.failures += 1
+            if self.state == 'half_open' or self.failures >= self.threshold:
+                self.state = 'open'
+                self.opened = time.monotonic()
+
+    def stats(self):
+        with self.lock:
+            return {'state': self.state, 'failures': self.failures, 'rejected': self.rejected}
+
+
+class DebugRecorder(object):
+    """ DebugRecorder
+
+        Hand debug responses to a background thread that writes them to
+        <folder>/<format>-responses/<method>.<format>(.gz) so the request path never waits on disk.
+        Only the newest `capacity` responses are kept when the writer falls behind.
+    """
+
+    def __init__(self, folder: str = 'docs', sample: float = 1.0, max_bytes: int = 1048576,
+                 capacity: int = 64, compress: bool = True):
+        self.folder = folder
+        self.sample = sample
+        self.max_bytes = max_bytes
+        self.compress = compress
+        self.queue = deque(maxlen=capacity)
+        self.condition = threading.Condition()
+        self.writing = False
+        self.stopped = False
+        self.counts = {'recorded': 0, 'sampled_out': 0, 'dropped': 0, 'written': 0}
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def record(self, api_format: str, method: str, full_url: str, response: bytes):
+        """ record
+
+            queue a response for the writer, this never blocks on the disk
+        """
+        if self.sample < 1 and random.random() >= self.sample:
+            with self.condition:
+                self.counts['sampled_out'] += 1
+            return
+        # keep the auth token out of the output
+        url = re.sub(r'([?&]auth=)[^&]*', r'\1*', full_url)
+        with self.condition:
+            if self.stopped:
+                self.counts['dropped'] += 1
+                return
+            if len(self.queue) == self.queue.maxlen:
+                self.counts['dropped'] += 1
+            self.queue.append((api_format, method, url, response[:self.max_bytes], len(response)))
+            self.counts['recorded'] += 1
+            self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.queue:
+                    self.writing = False
+                    self.condition.notify_all()
+                    if self.stopped:
+                        return
+                    self.condition.wait()
+                self.writing = True
+                api_format, method, url, response, size = self.queue.popleft()
+            print(url + ' (' + str(size) + ' bytes)')
+            path = os.path.join(self.folder, api_format + '-responses', method + '.' + api_format)
+            try:
+                if self.compress:
+                    with gzip.open(path + '.gz', 'wb', compresslevel=5) as debug_file:
+                        debug_file.write(response)
+                else:
+                    with open(path, 'wb') as debug_file:
+                        debug_file.write(response)
+            except OSError:
+                continue
+            with self.condition:
+                self.counts['written'] += 1
+
+    def flush(self, timeout: float = None):
+        """ flush
+
+            wait until every queued response has been written
+        """
+        with self.condition:
+            return self.condition.wait_for(lambda: not self.queue and not self.writing, timeout)
+
+    def stop(self):
+        """ stop
+
+            write what is already queued then end the writer thread, later responses are dropped
+        """
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+
+    def stats(self):
+        with self.condition:
+            return dict(self.counts, queued=len(self.queue))
+
+
+class TraceRecorder(object):
+    """ TraceRecorder
+
+        Write the sequence, timing and size of api requests to a gzipped json lines file
+        for ampachereplay.py. Credentials (TRACE_SCRUB) are never written.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.started = time.monotonic()
+        self.threads = dict()
+        self.lock = threading.Lock()
+        self.trace_file = gzip.open(path, 'wt', encoding='utf-8', compresslevel=5)
+        self.write({'trace': 1, 'started': datetime.now().isoformat(timespec='seconds')})
+
+    def write(self, entry: dict):
+        self.trace_file.write(json.dumps(entry, separators=(',', ':')) + '\n')
+
+    def record(self, full_url: str, api_format: str, kind: str, size: int, success: bool, elapsed: float,
+               attribute: str = ''):
+        """ record
+
+            add one request to the trace
+
+            INPUTS
+            * full_url   = (string) requested url
+            * api_format = (string) 'xml'|'json'
+            * kind       = (string) 'data' (fetch_url), 'stream' (stream_objects) or 'file' (fetch_file)
+            * size       = (integer) response bytes
+            * success    = (boolean)
+            * elapsed    = (float) seconds the call took
+            * attribute  = (string) object tag read from a 'stream' response //optional
+        """
+        params = dict(urllib.parse.parse_qsl(urllib.parse.urlsplit(full_url).query))
+        for name in TRACE_SCRUB:
+            params.pop(name, None)
+        params = {name: TRACE_SCRUB_URL.sub(r'\1*', value) for name, value in params.items()}
+        action = params.pop('action', '')
+        with self.lock:
+            if self.trace_file is None:
+                return
+            thread = self.threads.setdefault(threading.get_ident(), len(self.threads))
+            entry = {'t': round(time.monotonic() - self.started - elapsed, 4), 'thread': thread,
+                     'action': action, 'params': params, 'format': api_format, 'kind': kind,
+                     'bytes': size, 'ok': bool(success), 'elapsed': round(elapsed, 4)}
+            if attribute:
+                entry['attribute'] = attribute
+            self.write(entry)
+
+    def close(self):
+        with self.lock:
+            if self.trace_file is not None:
+                self.trace_file.close()
+                self.trace_file = None
+
+
+def get_record_values(data_object):
+    """ get_record_values
+
+        flatten a json object or xml element into a dict. Nested objects become
+        {'id': id, 'name': name} and repeated xml tags become a list.
+
+        INPUTS
+        * data_object = (mixed) dict or Element for one object
+    """
+    if isinstance(data_object, dict):
+        return data_object
+    values = dict(data_object.attrib)
+    for child in data_object:
+        value = child.text
+        if 'id' in child.attrib:
+            value = {'id': child.attrib['id'], 'name': child.text}
+        if child.tag not in values:
+            values[child.tag] = value
+        elif isinstance(values[child.tag], list):
+            values[child.tag].append(value)
+        else:
+            values[child.tag] = [values[child.tag], value]
+    return values
+
+
+def to_int(value):
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return 0
+
+
+def to_text(value):
+    if value is None:
+        return ''
+    return str(value)
+
+
+def to_name(value):
+    """ text that repeats across objects (artist, album, genre, etc) is interned """
+    if value is None:
+        return ''
+    return sys.intern(str(value))
+
+
+class Record(object):
+    """ Record
+
+        Base class for typed api objects. Subclasses list their plain fields as
+        (name, converter) and the nested objects they keep as a name and an id.
+        Names that repeat (artist, album, genre) are interned so each is only stored once.
+    """
+    __slots__ = ()
+    fields = ()
+    references = ()
+
+    @classmethod
+    def from_data(cls, data_object):
+        """ from_data
+
+            build a record from a json dict or an xml Element
+
+            INPUTS
+            * data_object = (mixed) dict or Element for one object
+        """
+        values = get_record_values(data_object)
+        record = cls.__new__(cls)
+        for name, converter in cls.fields:
+            setattr(record, name, converter(values.get(name)))
+        for name in cls.references:
+            reference = values.get(name)
+            if isinstance(reference, list):
+                reference = reference[0] if reference else None
+            if isinstance(reference, dict):
+                setattr(record, name + '_id', to_int(reference.get('id')))
+                setattr(record, name, to_name(reference.get('name')))
+            else:
+                setattr(record, name + '_id', 0)
+                setattr(record, name, to_name(reference))
+        if 'genre' in cls.__slots__:
+            genres = values.get('genre') or []
+            if not isinstance(genres, list):
+                genres = [genres]
+            record.genre = tuple(to_name(genre.get('name') if isinstance(genre, dict) else genre)
+                                 for genre in genres)
+        return record
+
+    def __repr__(self):
+        return self.__class__.__name__ + '(' + ', '.join(
+            name + '=' + repr(getattr(self, name)) for name in self.__slots__) + ')'
+
+
+class Song(Record):
+    __slots__ = ('id', 'title', 'artist_id', 'artist', 'album_id', 'album', 'genre',
+                 'track', 'year', 'time', 'rating', 'playcount', 'mime')
+    fields = (('id', to_int), ('title', to_text), ('track', to_int), ('year', to_int), ('time', to_int),
+              ('rating', to_int), ('playcount', to_int), ('mime', to_name))
+    references = ('artist', 'album')
+
+
+class Album(Record):
+    __slots__ = ('id', 'name', 'artist_id', 'artist', 'genre', 'year', 'songcount', 'time', 'rating')
+    fields = (('id', to_int), ('name', to_text), ('year', to_int), ('songcount', to_int), ('time', to_int),
+              ('rating', to_int))
+    references = ('artist',)
+
+
+class Artist(Record):
+    __slots__ = ('id', 'name', 'genre', 'albumcount', 'songcount', 'time', 'rating')
+    fields = (('id', to_int), ('name', to_text), ('albumcount', to_int), ('songcount', to_int), ('time', to_int),
+              ('rating', to_int))
+
+
+class Playlist(Record):
+    __slots__ = ('id', 'name', 'owner', 'items', 'type')
+    fields = (('id', to_int), ('name', to_text), ('owner', to_name), ('items', to_int), ('type', to_name))
+
+
+class PodcastEpisode(Record):
+    __slots__ = ('id', 'title', 'podcast_id', 'podcast', 'pubdate', 'state', 'time', 'filesize')
+    fields = (('id', to_int), ('title', to_text), ('pubdate', to_text), ('state', to_name), ('time', to_int),
+              ('filesize', to_int))
+    references = ('podcast',)
+
+
+class LocalplayStatus(Record):
+    __slots__ = ('state', 'volume', 'repeat', 'random', 'track', 'track_title', 'track_artist', 'track_album')
+    fields = (('state', to_name), ('volume', to_int), ('repeat', to_int), ('random', to_int), ('track', to_int),
+              ('track_title', to_text), ('track_artist', to_text), ('track_album', to_text))
+
+    @classmethod
+    def from_response(cls, data):
+        """ from_response
+
+            build the status from a full localplay('status') response, False if there isn't one
+
+            INPUTS
+            * data = (mixed) XML or JSON from the API
+        """
+        if isinstance(data, dict):
+            try:
+                return cls.from_data(data['localplay']['command']['status'])
+            except (KeyError, TypeError):
+                return False
+        if data is False or data is None:
+            return False
+        status = data.find('.//status')
+        if status is None:
+            return False
+        return cls.from_data(status)
+
+
+# record class for each object tag
+RECORD_TYPES = {'song': Song,
+                'album': Album,
+                'artist': Artist,
+                'playlist': Playlist,
+                'podcast_episode': PodcastEpisode}
+
+
+class IdArray(object):
+    """ IdArray
+
+        Ordered list of integer object ids stored in a compact array('q').
+        Supports set operations that keep the order of the left hand list,
+        e.g. missing = wanted - current, to reconcile two playlists.
+    """
+    __slots__ = ('ids',)
+
+    def __init__(self, ids=()):
+        if isinstance(ids, IdArray):
+            ids = ids.ids
+        if isinstance(ids, array) and ids.typecode == 'q':
+            self.ids = array('q', ids)
+        else:
+            self.ids = array('q', (int(object_id) for object_id in ids))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        return iter(self.ids)
+
+    def __getitem__(self, index):
+        return self.ids[index]
+
+    def __contains__(self, object_id):
+        return int(object_id) in self.ids
+
+    def __eq__(self, other):
+        return isinstance(other, IdArray) and self.ids == other.ids
+
+    def __repr__(self):
+        return 'IdArray(' + repr(self.ids.tolist()) + ')'
+
+    def append(self, object_id):
+        self.ids.append(int(object_id))
+
+    def tolist(self):
+        return self.ids.tolist()
+
+    def union(self, other):
+        """ ids in this list followed by ids only in the other """
+        seen = set(self.ids)
+        result = IdArray(self)
+        result.ids.extend(object_id for object_id in IdArray(other) if object_id not in seen)
+        return result
+
+    def difference(self, other):
+        """ ids in this list that aren't in the other """
+        other = set(IdArray(other).ids)
+        return IdArray(array('q', (object_id for object_id in self.ids if object_id not in other)))
+
+    def intersection(self, other):
+        """ ids in this list that are also in the other """
+        other = set(IdArray(other).ids)
+        return IdArray(array('q', (object_id for object_id in self.ids if object_id in other)))
+
+    __or__ = union
+    __sub__ = difference
+    __and__ = intersection
+
 
 class API(object):
 
@@ -41,6 +944,42 @@ class API(object):
         self.AMPACHE_SESSION = ''
         self.AMPACHE_USER = ''
         self.AMPACHE_KEY = ''
+        self.AMPACHE_SESSION_EXPIRE = 0
+        self.AMPACHE_COUNTS = dict()
+        # keep-alive connection pool shared by every request
+        self.AMPACHE_POOL_SIZE = 10
+        self.AMPACHE_POOL_IDLE = 60
+        self.session = None
+        self.session_used = 0
+        self.session_lock = threading.Lock()
+        # set by stream_objects so the next request is parsed as it arrives
+        self.stream_state = threading.local()
+        # cache for read-only actions (set_cache(0) to disable)
+        self.AMPACHE_CACHE = ResponseCache()
+        # rate and concurrency limits for each class of action (set_limiter(False) to disable)
+        self.AMPACHE_LIMITER = RequestLimiter()
+        # seconds to connect and to wait for data, failed reads are retried with jittered backoff
+        self.AMPACHE_TIMEOUT = (5, 30)
+        self.AMPACHE_RETRIES = 2
+        self.AMPACHE_BACKOFF = 0.25
+        self.AMPACHE_BACKOFF_MAX = 4
+        # stop sending requests to a server that keeps failing (set_breaker(0) to disable)
+        self.AMPACHE_BREAKER = CircuitBreaker()
+        # per action request counts, bytes and latency (set_metrics(False) to disable)
+        self.AMPACHE_METRICS = RequestMetrics()
+        self.metrics_state = threading.local()
+        # writes AMPACHE_DEBUG responses in the background (created by set_debug or on first use)
+        self.AMPACHE_RECORDER = None
+        # records the requests made for replaying later (see set_trace)
+        self.AMPACHE_TRACE = None
+        # identical read requests made at the same time share one http request
+        self.AMPACHE_SINGLE_FLIGHT = True
+        self.inflight = dict()
+        self.inflight_lock = threading.Lock()
+        # bytes held in memory at a time by stream, download and get_art
+        self.AMPACHE_CHUNK_SIZE = 65536
+        # objects requested per page by the iter_* functions
+        self.AMPACHE_PAGE_SIZE = 500
         # Test colors for printing
         self.OKGREEN = '\033[92m'
         self.WARNING = '\033[93m'
@@ -78,6 +1017,36 @@ class API(object):
         else:
             print('AMPACHE_DEBUG' + f": {self.WARNING}disabled{self.ENDC}")
         self.AMPACHE_DEBUG = mybool
+        if mybool:
+            self.get_recorder()
+
+    def set_recorder(self, folder: str = 'docs', sample: float = 1.0, max_bytes: int = 1048576,
+                     capacity: int = 64, compress: bool = True):
+        """ set_recorder
+
+            Configure how AMPACHE_DEBUG responses are written
+
+            INPUTS
+            * folder    = (string) responses go in <folder>/<format>-responses/ (if it exists) //optional
+            * sample    = (float) fraction of responses to keep e.g. 0.1 //optional
+            * max_bytes = (integer) responses are cut at this size //optional
+            * capacity  = (integer) responses waiting to be written before the oldest are dropped //optional
+            * compress  = (boolean) gzip the files (<method>.<format>.gz) //optional
+        """
+        with self.session_lock:
+            if self.AMPACHE_RECORDER:
+                self.AMPACHE_RECORDER.stop()
+            self.AMPACHE_RECORDER = DebugRecorder(folder, sample, max_bytes, capacity, compress)
+
+    def get_recorder(self):
+        """ get_recorder
+
+            Return the debug recorder, creating one with the default settings on first use
+        """
+        with self.session_lock:
+            if not self.AMPACHE_RECORDER:
+                self.AMPACHE_RECORDER = DebugRecorder()
+            return self.AMPACHE_RECORDER
 
     def set_user(self, myuser: str):
         """ set_user
@@ -109,6 +1078,352 @@ class API(object):
         """
         self.AMPACHE_URL = myurl
 
+    def set_pool(self, pool_size: int = 10, idle_timeout: int = 60):
+        """ set_pool
+
+            Configure the keep-alive connection pool used for every request
+
+            INPUTS
+            * pool_size    = (integer) connections kept open per host
+            * idle_timeout = (integer) seconds a pool can sit unused before it is closed
+        """
+        self.AMPACHE_POOL_SIZE = pool_size
+        self.AMPACHE_POOL_IDLE = idle_timeout
+        self.close_pool()
+
+    def get_pool(self):
+        """ get_pool
+
+            Return the shared requests session, creating it on first use and
+            replacing it when it has been idle longer than AMPACHE_POOL_IDLE
+        """
+        with self.session_lock:
+            now = time.monotonic()
+            if self.session and now - self.session_used > self.AMPACHE_POOL_IDLE:
+                self.session.close()
+                self.session = None
+            if not self.session:
+                adapter = requests.adapters.HTTPAdapter(pool_connections=self.AMPACHE_POOL_SIZE,
+                                                        pool_maxsize=self.AMPACHE_POOL_SIZE)
+                # time new connections for the metrics
+                adapter.poolmanager.pool_classes_by_scheme = {'http': TimedHTTPConnectionPool,
+                                                              'https': TimedHTTPSConnectionPool}
+                self.session = requests.Session()
+                self.session.mount('http://', adapter)
+                self.session.mount('https://', adapter)
+            self.session_used = now
+            return self.session
+
+    def close_pool(self):
+        """ close_pool
+
+            Close every open connection in the pool
+        """
+        with self.session_lock:
+            if self.session:
+                self.session.close()
+            self.session = None
+
+    def set_cache(self, max_bytes: int = 16777216, ttls: dict = None):
+        """ set_cache
+
+            Configure the response cache for read-only actions
+
+            INPUTS
+            * max_bytes = (integer) memory budget for cached responses, 0 disables the cache
+            * ttls      = (dict) {action: seconds} overrides for the default CACHE_TTLS //optional
+        """
+        self.AMPACHE_CACHE = ResponseCache(max_bytes, ttls) if max_bytes > 0 else None
+
+    def set_limiter(self, enabled: bool = True, settings: dict = None):
+        """ set_limiter
+
+            Configure the client side rate and concurrency limits
+
+            INPUTS
+            * enabled  = (boolean)
+            * settings = (dict) {'control'|'bulk'|'download': {setting: value}} overrides for LIMITER_SETTINGS //optional
+        """
+        self.AMPACHE_LIMITER = RequestLimiter(settings) if enabled else None
+
+    def set_timeout(self, connect: float = 5, read: float = 30):
+        """ set_timeout
+
+            Set the seconds to wait for a connection and between bytes of a response
+
+            INPUTS
+            * connect = (float)
+            * read    = (float)
+        """
+        self.AMPACHE_TIMEOUT = (connect, read)
+
+    def set_retries(self, retries: int = 2, backoff: float = 0.25, max_backoff: float = 4):
+        """ set_retries
+
+            Set how read-only requests are retried after a connection error, timeout, 429 or 5xx.
+            The wait before retry n is backoff * 2^(n-1) (at most max_backoff) with +-50% jitter.
+
+            INPUTS
+            * retries     = (integer) extra attempts, 0 disables retries
+            * backoff     = (float) seconds before the first retry //optional
+            * max_backoff = (float) longest wait between attempts //optional
+        """
+        self.AMPACHE_RETRIES = max(0, retries)
+        self.AMPACHE_BACKOFF = backoff
+        self.AMPACHE_BACKOFF_MAX = max_backoff
+
+    def set_breaker(self, threshold: int = 5, reset_timeout: float = 30):
+        """ set_breaker
+
+            Configure the circuit breaker
+
+            INPUTS
+            * threshold     = (integer) failures in a row before requests fail fast, 0 disables the breaker
+            * reset_timeout = (float) seconds between probe requests while the server is failing //optional
+        """
+        self.AMPACHE_BREAKER = CircuitBreaker(threshold, reset_timeout) if threshold > 0 else None
+
+    def set_metrics(self, enabled: bool = True):
+        """ set_metrics
+
+            Turn the per action request metrics on or off (this also resets them)
+
+            INPUTS
+            * enabled = (boolean)
+        """
+        self.AMPACHE_METRICS = RequestMetrics() if enabled else None
+
+    def get_metrics(self):
+        """ get_metrics
+
+            return a snapshot of the request metrics for each action (see RequestMetrics.snapshot)
+        """
+        if not self.AMPACHE_METRICS:
+            return dict()
+        return self.AMPACHE_METRICS.snapshot()
+
+    def write_metrics(self, path: str):
+        """ write_metrics
+
+            write the request metrics to a prometheus text file
+
+            INPUTS
+            * path = (string) full file path e.g. '/var/lib/node_exporter/ampache.prom'
+        """
+        if not self.AMPACHE_METRICS:
+            return False
+        try:
+            self.AMPACHE_METRICS.write_prometheus(path)
+        except OSError:
+            return False
+        return True
+
+    def set_trace(self, path: str = None):
+        """ set_trace
+
+            Start recording every request to a trace file for ampachereplay.py, or stop with no path
+
+            INPUTS
+            * path = (string) full file path e.g. 'session.trace.gz' //optional
+        """
+        if self.AMPACHE_TRACE:
+            self.AMPACHE_TRACE.close()
+            self.AMPACHE_TRACE = None
+        if path:
+            try:
+                self.AMPACHE_TRACE = TraceRecorder(path)
+            except OSError:
+                return False
+        return True
+
+    def set_single_flight(self, enabled: bool = True):
+        """ set_single_flight
+
+            Share one http request between threads asking for the same read-only url at the same time
+
+            INPUTS
+            * enabled = (boolean)
+        """
+        self.AMPACHE_SINGLE_FLIGHT = bool(enabled)
+
+    def is_shared(self, action: str, params: dict):
+        """ is_shared
+
+            return True when concurrent calls for an action can share a response
+
+            INPUTS
+            * action = (string) api action
+            * params = (dict) request parameters
+        """
+        if action in CACHE_TTLS or action in SHARED_ACTIONS:
+            return True
+        if action in SHARED_COMMANDS:
+            name, value = SHARED_COMMANDS[action]
+            return params.get(name) == value
+        return False
+
+    def fetch_shared(self, full_url: str):
+        """ fetch_shared
+
+            return the response for a url, joining a request for the same url that is already in flight
+
+            INPUTS
+            * full_url = (string) url to fetch
+        """
+        with self.inflight_lock:
+            call = self.inflight.get(full_url)
+            leader = call is None
+            if leader:
+                call = self.inflight[full_url] = types.SimpleNamespace(done=threading.Event(), result=False)
+        if not leader:
+            call.done.wait()
+            return call.result
+        try:
+            call.result = self.get_content(full_url)
+        finally:
+            with self.inflight_lock:
+                del self.inflight[full_url]
+            call.done.set()
+        return call.result
+
+    @staticmethod
+    def is_available(result):
+        """ is_available
+
+            return False when there was no response or the server is overloaded (429, 5xx)
+
+            INPUTS
+            * result = (requests.Response|None)
+        """
+        return result is not None and result.status_code != 429 and result.status_code < 500
+
+    @staticmethod
+    def is_unsent(error):
+        """ is_unsent
+
+            return True when a request failed before anything was sent
+            (connect timeout, connection refused or the host didn't resolve)
+
+            INPUTS
+            * error = (requests.exceptions.ConnectionError)
+        """
+        if isinstance(error, requests.exceptions.ConnectTimeout):
+            return True
+        reason = getattr(error.args[0], 'reason', None) if error.args else None
+        return isinstance(reason, urllib3.exceptions.NewConnectionError)
+
+    def get_response(self, full_url: str, stream: bool = False, headers: dict = None):
+        """ get_response
+
+            GET a url with the timeouts, retries and circuit breaker. Only read-only actions
+            are retried (other actions only when the connection couldn't be made).
+            Returns the last requests.Response or None when there wasn't one.
+
+            INPUTS
+            * full_url = (string) url to fetch
+            * stream   = (boolean) return before the body is read //optional
+            * headers  = (dict) extra request headers //optional
+        """
+        action, params = ResponseCache.get_key(full_url)[1:]
+        idempotent = self.is_shared(action, params) or RequestLimiter.get_class(action) == 'download'
+        breaker = self.AMPACHE_BREAKER
+        result = None
+        for attempt in range(self.AMPACHE_RETRIES + 1):
+            if attempt:
+                time.sleep(min(self.AMPACHE_BACKOFF * 2 ** (attempt - 1), self.AMPACHE_BACKOFF_MAX) *
+                           (0.5 + random.random()))
+            if breaker and not breaker.allow():
+                return result
+            result = None
+            try:
+                result = self.send_request(full_url, action, stream, headers)
+            except requests.exceptions.ConnectionError as error:
+                if self.is_unsent(error):
+                    # nothing was sent so any action can be tried again
+                    if breaker:
+                        breaker.record(False)
+                    continue
+            except requests.exceptions.RequestException:
+                pass
+            except ValueError:
+                return None
+            available = self.is_available(result)
+            if breaker:
+                breaker.record(available)
+            if available or not idempotent:
+                return result
+            if result is not None and attempt < self.AMPACHE_RETRIES:
+                result.close()
+        return result
+
+    def send_request(self, full_url: str, action: str, stream: bool = False, headers: dict = None):
+        """ send_request
+
+            one GET from the connection pool, recorded in AMPACHE_METRICS
+
+            INPUTS
+            * full_url = (string) url to fetch
+            * action   = (string) api action for the metrics
+            * stream   = (boolean) return before the body is read //optional
+            * headers  = (dict) extra request headers //optional
+        """
+        metrics = self.AMPACHE_METRICS
+        if not metrics:
+            return self.get_pool().get(full_url, stream=stream, headers=headers, timeout=self.AMPACHE_TIMEOUT)
+        CONNECT_STATE.seconds = 0
+        try:
+            result = self.get_pool().get(full_url, stream=stream, headers=headers, timeout=self.AMPACHE_TIMEOUT)
+        except requests.exceptions.RequestException:
+            metrics.record(action, False, 0, len(full_url), CONNECT_STATE.seconds)
+            raise
+        connect = CONNECT_STATE.seconds
+        if stream:
+            bytes_in = int(result.headers.get('Content-Length') or 0)
+        else:
+            bytes_in = len(result.content)
+        metrics.record(action, result.status_code < 400, bytes_in, len(full_url), connect,
+                       max(result.elapsed.total_seconds() - connect, 0))
+        return result
+
+    def get_content(self, full_url: str):
+        """ get_content
+
+            return the body of a url from the connection pool or False on failure
+
+            INPUTS
+            * full_url = (string) url to fetch
+        """
+        limiter = self.AMPACHE_LIMITER
+        action = ResponseCache.get_key(full_url)[1]
+        if limiter:
+            limiter.acquire(action)
+        result = None
+        try:
+            result = self.get_response(full_url)
+            if result is None:
+                return False
+            result.raise_for_status()
+        except requests.exceptions.RequestException:
+            return False
+        except ValueError:
+            return False
+        finally:
+            if limiter:
+                limiter.release(action, self.is_available(result),
+                                result.elapsed.total_seconds() if result is not None else 0)
+        return result.content
+
+    def set_page_size(self, page_size: int):
+        """ set_page_size
+
+            set how many objects the iter_* functions request at a time
+
+            INPUTS
+            * page_size = (integer) objects per request (must be more than 0)
+        """
+        if page_size > 0:
+            self.AMPACHE_PAGE_SIZE = page_size
+
     def test_result(self, result, title):
         """ set_debug
 
@@ -130,47 +1445,386 @@ class API(object):
         return False
 
     def return_data(self, data):
+        # streamed response from stream_objects
+        if isinstance(data, requests.Response):
+            if self.AMPACHE_API == 'json':
+                return self.iter_json_objects(data, data.attribute)
+            return self.iter_xml_objects(data, data.attribute)
+        started = time.perf_counter()
         # json format
         if self.AMPACHE_API == 'json':
-            json_data = json.loads(data.decode('utf-8'))
-            return json_data
+            result = json.loads(data.decode('utf-8'))
         # xml format
         else:
             try:
-                tree = ElementTree.fromstring(data.decode('utf-8'))
+                result = ElementTree.fromstring(data.decode('utf-8'))
             except ElementTree.ParseError:
-                return False
-            return tree
+                result = False
+        action = getattr(self.metrics_state, 'action', False)
+        if self.AMPACHE_METRICS and action:
+            self.AMPACHE_METRICS.observe(action, 'parse', time.perf_counter() - started)
+        return result
+
+    def iter_json_objects(self, response, attribute: str):
+        """ iter_json_objects
+
+            Generator that parses a streamed json response and yields each object in the
+            attribute list as soon as it has arrived, so only one object is held in memory.
+
+            INPUTS
+            * response    = (requests.Response) open response from a streamed request
+            * attribute   = (string) list you are reading e.g. 'song'
+        """
+        decoder = json.JSONDecoder()
+        text = codecs.getincrementaldecoder('utf-8')()
+        start = re.compile(r'"' + re.escape(attribute) + r'"\s*:\s*\[')
+        chunks = response.iter_content(self.AMPACHE_CHUNK_SIZE)
+        buffer = ''
+        position = 0
+        try:
+            # skip to the start of the list
+            while True:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    # there was no list, only an empty result means there are no objects
+                    try:
+                        error = self.get_error_code(json.loads(buffer))
+                    except ValueError:
+                        error = False
+                    if error in ('404', '4704'):
+                        return
+                    raise PageError(attribute + ' response has no list' + (' (error ' + error + ')' if error else ''),
+                                    error)
+                buffer += text.decode(chunk)
+                match = start.search(buffer)
+                if match:
+                    position = match.end()
+                    break
+                # keep a small body whole in case it is an error
+                if len(buffer) > self.AMPACHE_CHUNK_SIZE:
+                    buffer = buffer[-len(attribute) - 32:]
+            while True:
+                while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                    position += 1
+                if position < len(buffer) and buffer[position] == ']':
+                    return
+                try:
+                    data_object, position = decoder.raw_decode(buffer, position)
+                except ValueError:
+                    # the next object is incomplete, read some more
+                    chunk = next(chunks, None)
+                    if chunk is None:
+                        raise PageError(attribute + ' response ended before the end of the list')
+                    buffer = buffer[position:] + text.decode(chunk)
+                    position = 0
+                    continue
+                yield data_object
+        finally:
+            response.close()
+
+    def iter_xml_objects(self, response, attribute: str):
+        """ iter_xml_objects
+
+            Generator that feeds a streamed xml response to an incremental parser and yields
+            each matching child of the root element once it is complete. Yielded elements are
+            detached from the tree so nothing is kept after the caller lets go of them.
+
+            INPUTS
+            * response    = (requests.Response) open response from a streamed request
+            * attribute   = (string) child tag you are reading e.g. 'song'
+        """
+        parser = ElementTree.XMLPullParser(events=('start', 'end'))
+        root = None
+        depth = 0
+        try:
+            for chunk in response.iter_content(self.AMPACHE_CHUNK_SIZE):
+                parser.feed(chunk)
+                for event, element in parser.read_events():
+                    if event == 'start':
+                        if root is None:
+                            root = element
+                        depth += 1
+                        continue
+                    depth -= 1
+                    if depth == 1:
+                        root.remove(element)
+                        if element.tag == attribute:
+                            yield element
+                        elif element.tag == 'error':
+                            error = element.attrib.get('errorCode', element.attrib.get('code'))
+                            if error not in ('404', '4704'):
+                                raise PageError(attribute + ' response is an error (' + str(error) + ')', error)
+            # raises ParseError if the document wasn't finished
+            parser.close()
+        except ElementTree.ParseError:
+            raise PageError(attribute + ' response is incomplete or invalid xml')
+        finally:
+            response.close()
+
+    def stream_objects(self, method, attribute: str, *args, **kwargs):
+        """ stream_objects
+
+            Generator that calls an API function and yields the objects (dict or Element) in its
+            response while the body is still downloading. Memory use stays at about one object however large the list is.
+            Raises PageError if the request fails, the response is cut short or the server
+            sent an error other than an empty result (404, 4704).
+
+            e.g. for song in ampache.stream_objects(ampache.playlist_songs, 'song', playlist_id):
+
+            INPUTS
+            * method      = (function) API function that returns a list e.g. self.songs
+            * attribute   = (string) object tag in the response e.g. 'song'
+            * args/kwargs = arguments for method
+        """
+        self.stream_state.attribute = attribute
+        try:
+            data = method(*args, **kwargs)
+        finally:
+            self.stream_state.attribute = False
+        if data is False:
+            raise PageError(method.__name__ + ' failed')
+        if not isinstance(data, types.GeneratorType):
+            data = self.get_page_objects(data, attribute)
+        for data_object in data:
+            yield data_object
 
     def get_id_list(self, data, attribute: str):
         """ get_id_list
 
-            return a list of id's from the data you've got from the api
+            return a list of id's from the data you've got from the api
+
+            INPUTS
+            * data        = (mixed) XML or JSON from the API
+            * attribute   = (string) attribute you are searching for
+        """
+        id_list = list()
+        if not data:
+            return id_list
+        if self.AMPACHE_API == 'xml':
+            try:
+                for child in data:
+                    if child.tag == attribute:
+                        id_list.append(child.attrib['id'])
+            except KeyError:
+                id_list.append(data['id'])
+        else:
+            try:
+                for data_object in data[attribute]:
+                    id_list.append(data_object['id'])
+            except TypeError:
+                for data_object in data:
+                    id_list.append(data_object[0])
+            except KeyError:
+                id_list.append(data['id'])
+        return id_list
+
+    def get_id_array(self, data, attribute: str):
+        """ get_id_array
+
+            return the id's from the data you've got from the api as a compact IdArray
+
+            INPUTS
+            * data        = (mixed) XML or JSON from the API
+            * attribute   = (string) attribute you are searching for
+        """
+        if self.AMPACHE_API == 'xml':
+            return IdArray(data_object.attrib['id'] for data_object in self.get_page_objects(data, attribute))
+        return IdArray(data_object['id'] for data_object in self.get_page_objects(data, attribute))
+
+    def stream_id_array(self, method, attribute: str, *args, **kwargs):
+        """ stream_id_array
+
+            return an IdArray built while the response downloads, keeping only the ids (see stream_objects)
+
+            e.g. current = ampache.stream_id_array(ampache.playlist_songs, 'song', playlist_id)
+
+            INPUTS
+            * method      = (function) API function that returns a list e.g. self.playlist_songs
+            * attribute   = (string) object tag in the response e.g. 'song'
+            * args/kwargs = arguments for method
+        """
+        id_array = IdArray()
+        for data_object in self.stream_objects(method, attribute, *args, **kwargs):
+            id_array.append(data_object['id'] if isinstance(data_object, dict) else data_object.attrib['id'])
+        return id_array
+
+    def get_page_objects(self, data, attribute: str):
+        """ get_page_objects
+
+            return the list of objects (dict or Element) in a single response
+
+            INPUTS
+            * data        = (mixed) XML or JSON from the API
+            * attribute   = (string) object tag you are searching for e.g. 'song'
+        """
+        if data is False or data is None:
+            return list()
+        if self.AMPACHE_API == 'xml':
+            return data.findall(attribute)
+        try:
+            objects = data[attribute]
+        except (KeyError, TypeError):
+            return list()
+        if isinstance(objects, dict):
+            return [objects]
+        return objects
+
+    def paginate(self, method, attribute: str, page_size: int = 0, offset: int = 0, **kwargs):
+        """ paginate
+
+            Generator that pages through a list action and yields one object at a time.
+            The next page is requested in the background while the current one is consumed.
+            Failed pages are retried (see fetch_page) and raise PageError if they still fail.
+
+            INPUTS
+            * method      = (function) API list function that takes offset and limit
+            * attribute   = (string) object tag in the response e.g. 'song'
+            * page_size   = (integer) objects per request (AMPACHE_PAGE_SIZE by default) //optional
+            * offset      = (integer) starting offset //optional
+            * kwargs      = other arguments for method
+        """
+        if page_size <= 0:
+            page_size = self.AMPACHE_PAGE_SIZE
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix='ampache-page') as prefetch:
+            future = prefetch.submit(self.get_page, method, attribute, offset, page_size, **kwargs)
+            while future:
+                page, error = future.result()
+                if page is False:
+                    raise PageError(method.__name__ + ' failed at offset ' + str(offset), error)
+                offset += page_size
+                future = None
+                if len(page) >= page_size:
+                    future = prefetch.submit(self.get_page, method, attribute, offset, page_size, **kwargs)
+                for data_object in page:
+                    yield data_object
+
+    def get_count(self, object_type: str):
+        """ get_count
+
+            return the server total for an object type, pinging the server if it isn't known yet
+
+            INPUTS
+            * object_type = (string) 'song'|'album'|'artist'|'playlist'|'podcast_episode'
+        """
+        key = object_type + 's'
+        if key not in self.AMPACHE_COUNTS and self.AMPACHE_SESSION:
+            self.ping(self.AMPACHE_URL, self.AMPACHE_SESSION)
+        return self.AMPACHE_COUNTS.get(key, False)
+
+    def fetch_page(self, method, attribute: str, offset: int, limit: int, retries: int = 2, **kwargs):
+        """ fetch_page
+
+            return the objects for one page of a list action, retrying failed requests
+            (except a rejected session). An empty list is returned for an empty page and False if every attempt failed.
+
+            INPUTS
+            * method      = (function) API list function that takes offset and limit
+            * attribute   = (string) object tag in the response e.g. 'song'
+            * offset      = (integer)
+            * limit       = (integer)
+            * retries     = (integer) extra attempts after a failure //optional
+            * kwargs      = other arguments for method
+        """
+        return self.get_page(method, attribute, offset, limit, retries, **kwargs)[0]
+
+    def get_page(self, method, attribute: str, offset: int, limit: int, retries: int = 2, **kwargs):
+        """ get_page
+
+            fetch_page that also returns why the page failed: (objects, False) or
+            (False, api error code or False). A rejected session isn't retried.
+
+            INPUTS
+            * method      = (function) API list function that takes offset and limit
+            * attribute   = (string) object tag in the response e.g. 'song'
+            * offset      = (integer)
+            * limit       = (integer)
+            * retries     = (integer) extra attempts after a failure //optional
+            * kwargs      = other arguments for method
+        """
+        error = False
+        for attempt in range(retries + 1):
+            if attempt:
+                time.sleep(0.5 * 2 ** (attempt - 1))
+            data = method(offset=offset, limit=limit, **kwargs)
+            error = self.get_error_code(data)
+            if error in ('404', '4704'):
+                return list(), False
+            if data is not False and not error:
+                return self.get_page_objects(data, attribute), False
+            if error in AUTH_ERRORS:
+                break
+        return False, error
+
+    def fetch_all(self, object_type: str, parallel: int = 4, page_size: int = 0, retries: int = 2, **kwargs):
+        """ fetch_all
+
+            Fetch every object of a type using concurrent page requests and return them in server order.
+            The total from ping/handshake decides how many pages to request at once; when it isn't known
+            (or is out of date) pages are requested in batches of `parallel` until a short page comes back.
+            Returns False if a page still fails after its retries.
+
+            INPUTS
+            * object_type = (string) 'song'|'album'|'artist'|'playlist'|'podcast_episode'
+            * parallel    = (integer) concurrent page requests //optional
+            * page_size   = (integer) objects per request (AMPACHE_PAGE_SIZE by default) //optional
+            * retries     = (integer) extra attempts for each failed page //optional
+            * kwargs      = other arguments for the list function (filter_id is required for podcast_episode)
+        """
+        methods = {'song': self.songs,
+                   'album': self.albums,
+                   'artist': self.artists,
+                   'playlist': self.playlists,
+                   'podcast_episode': self.podcast_episodes}
+        if object_type not in methods:
+            return False
+        if page_size <= 0:
+            page_size = self.AMPACHE_PAGE_SIZE
+        # episode totals are for the whole server, not a single podcast
+        total = False
+        if object_type != 'podcast_episode':
+            total = self.get_count(object_type)
+        pages = -(-total // page_size) if total else parallel
+        results = list()
+        offset = 0
+        with ThreadPoolExecutor(max_workers=parallel, thread_name_prefix='ampache-fetch') as pool:
+            while pages:
+                futures = [pool.submit(self.fetch_page, methods[object_type], object_type, offset + page * page_size,
+                                       page_size, retries, **kwargs) for page in range(pages)]
+                offset += pages * page_size
+                pages = 0
+                for future in futures:
+                    page = future.result()
+                    if page is False:
+                        return False
+                    results.extend(page)
+                    pages = parallel if len(page) >= page_size else 0
+        return results
+
+    def get_records(self, data, attribute: str):
+        """ get_records
+
+            return the objects in a response as typed records (Song, Album, Artist, etc)
 
             INPUTS
             * data        = (mixed) XML or JSON from the API
-            * attribute   = (string) attribute you are searching for
+            * attribute   = (string) 'song'|'album'|'artist'|'playlist'|'podcast_episode'
         """
-        id_list = list()
-        if not data:
-            return id_list
-        if self.AMPACHE_API == 'xml':
-            try:
-                for child in data:
-                    if child.tag == attribute:
-                        id_list.append(child.attrib['id'])
-            except KeyError:
-                id_list.append(data['id'])
-        else:
-            try:
-                for data_object in data[attribute]:
-                    id_list.append(data_object['id'])
-            except TypeError:
-                for data_object in data:
-                    id_list.append(data_object[0])
-            except KeyError:
-                id_list.append(data['id'])
-        return id_list
+        return [RECORD_TYPES[attribute].from_data(data_object)
+                for data_object in self.get_page_objects(data, attribute)]
+
+    def stream_records(self, method, attribute: str, *args, **kwargs):
+        """ stream_records
+
+            Generator version of get_records that parses the response while it downloads (see stream_objects)
+
+            INPUTS
+            * method      = (function) API function that returns a list e.g. self.songs
+            * attribute   = (string) 'song'|'album'|'artist'|'playlist'|'podcast_episode'
+            * args/kwargs = arguments for method
+        """
+        record_type = RECORD_TYPES[attribute]
+        for data_object in self.stream_objects(method, attribute, *args, **kwargs):
+            yield record_type.from_data(data_object)
 
     @staticmethod
     def get_object_list(data, field: str, data_format: str = 'xml'):
@@ -235,6 +1889,80 @@ class API(object):
                 message = data['success']
         return message
 
+    def set_session(self, session: str):
+        """ set_session
+
+            Use a session token, cached responses are dropped when it changes so one user
+            is never served another user's (or session's) responses
+
+            INPUTS
+            * session = (string) auth token from handshake or ping
+        """
+        if session != self.AMPACHE_SESSION and self.AMPACHE_CACHE:
+            self.AMPACHE_CACHE.clear()
+        self.AMPACHE_SESSION = session
+
+    def set_session_expire(self, session_expire):
+        """ set_session_expire
+
+            Record when the current session expires as a UNIXTIME
+
+            INPUTS
+            * session_expire = (string) ISO 8601 date returned by ping or handshake
+        """
+        try:
+            self.AMPACHE_SESSION_EXPIRE = int(datetime.fromisoformat(session_expire).timestamp())
+        except (TypeError, ValueError):
+            self.AMPACHE_SESSION_EXPIRE = 0
+
+    def set_counts(self, data: dict):
+        """ set_counts
+
+            Keep the library totals (songs, albums, artists, etc) sent with ping or handshake
+
+            INPUTS
+            * data = (dict) response values
+        """
+        for key, value in data.items():
+            try:
+                self.AMPACHE_COUNTS[key] = int(value)
+            except (TypeError, ValueError):
+                continue
+
+    def get_error_code(self, data):
+        """ get_error_code
+
+            return the error code from an api response or False if it isn't an error
+
+            INPUTS
+            * data = (mixed) XML or JSON from the API
+        """
+        if self.AMPACHE_API == 'json':
+            try:
+                error = data['error']
+            except (KeyError, TypeError):
+                return False
+            try:
+                return str(error.get('errorCode', error.get('code')))
+            except AttributeError:
+                return False
+        if data is False or data is None:
+            return False
+        error = data.find('error')
+        if error is None:
+            return False
+        return error.attrib.get('errorCode', error.attrib.get('code'))
+
+    def is_auth_error(self, data):
+        """ is_auth_error
+
+            return True when the server rejected the session (expired or invalid)
+
+            INPUTS
+            * data = (mixed) XML or JSON from the API
+        """
+        return self.get_error_code(data) in AUTH_ERRORS
+
     @staticmethod
     def write_json(json_data: str, filename: str):
         """ write_json
@@ -283,34 +2011,154 @@ class API(object):
     def fetch_url(self, full_url: str, api_format: str, method: str):
         """ fetch_url
 
-            This function is used to fetch the string results using urllib
+            This function is used to fetch the string results using the shared connection pool
 
             INPUTS
             * full_url   = (string) url to fetch
             * api_format = (string) 'xml'|'json'
             * method     = (string)
         """
+        trace = self.AMPACHE_TRACE
+        if not trace:
+            return self.get_url(full_url, api_format, method)
+        attribute = getattr(self.stream_state, 'attribute', False)
+        started = time.perf_counter()
+        ampache_response = self.get_url(full_url, api_format, method)
+        if isinstance(ampache_response, requests.Response):
+            size = int(ampache_response.headers.get('Content-Length') or 0)
+        else:
+            size = len(ampache_response or b'')
+        trace.record(full_url, api_format, 'stream' if attribute else 'data', size, ampache_response is not False,
+                     time.perf_counter() - started, attribute or '')
+        return ampache_response
+
+    def get_url(self, full_url: str, api_format: str, method: str):
+        """ get_url
+
+            fetch_url without the trace recording
+        """
+        attribute = getattr(self.stream_state, 'attribute', False)
+        if attribute:
+            # stream_objects reads the body while it's parsed
+            self.stream_state.attribute = False
+            limiter = self.AMPACHE_LIMITER
+            action = ResponseCache.get_key(full_url)[1]
+            if limiter:
+                limiter.acquire(action)
+            result = None
+            try:
+                result = self.get_response(full_url, True)
+                if result is None:
+                    return False
+                result.raise_for_status()
+            except requests.exceptions.RequestException:
+                return False
+            except ValueError:
+                return False
+            finally:
+                # the slot covers the request, the body is read while it's parsed
+                if limiter:
+                    limiter.release(action, self.is_available(result),
+                                result.elapsed.total_seconds() if result is not None else 0)
+            result.attribute = attribute
+            return result
+        cache = self.AMPACHE_CACHE
+        key, action, params = ResponseCache.get_key(full_url)
+        # return_data records the parse time against this action
+        self.metrics_state.action = action
+        if cache and action in cache.ttls:
+            ampache_response = cache.get(key, action)
+            if ampache_response:
+                return ampache_response
+        if self.AMPACHE_SINGLE_FLIGHT and self.is_shared(action, params):
+            ampache_response = self.fetch_shared(full_url)
+        else:
+            ampache_response = self.get_content(full_url)
+        if ampache_response is False:
+            return False
+        if self.AMPACHE_METRICS and ResponseCache.is_error(ampache_response):
+            self.AMPACHE_METRICS.add_error(action)
+        if cache:
+            if action in CACHE_MUTATIONS:
+                cache.mutated(action, params)
+            else:
+                cache.set(key, action, params, ampache_response)
+        if self.AMPACHE_DEBUG:
+            self.get_recorder().record(api_format, method, full_url, ampache_response)
+        return ampache_response
+
+    def fetch_file(self, full_url: str, destination: str, callback=None, resume: bool = False):
+        """ fetch_file
+
+            Stream a url to a file in AMPACHE_CHUNK_SIZE chunks. The data is written to
+            destination + '.part' and renamed once the download is complete.
+
+            INPUTS
+            * full_url    = (string) url to fetch
+            * destination = (string) full file path
+            * callback    = (function) called with (bytes_done, bytes_total, bytes_per_second) //optional
+            * resume      = (boolean) continue an existing .part file with a Range request //optional
+        """
+        limiter = self.AMPACHE_LIMITER
+        action = ResponseCache.get_key(full_url)[1]
+        started = time.perf_counter()
+        success = False
+        if limiter:
+            limiter.acquire(action)
         try:
-            result = urllib.request.urlopen(full_url)
-        except urllib.error.URLError:
+            success = self.get_file(full_url, destination, callback, resume)
+        finally:
+            if limiter:
+                limiter.release(action, success)
+        if self.AMPACHE_TRACE:
+            size = os.path.getsize(destination) if success else 0
+            self.AMPACHE_TRACE.record(full_url, self.AMPACHE_API, 'file', size, success,
+                                      time.perf_counter() - started)
+        return success
+
+    def get_file(self, full_url: str, destination: str, callback=None, resume: bool = False):
+        """ get_file
+
+            fetch_file without the request limiter
+        """
+        part = destination + '.part'
+        offset = 0
+        headers = dict()
+        if resume and os.path.isfile(part):
+            offset = os.path.getsize(part)
+            headers['Range'] = 'bytes=' + str(offset) + '-'
+        result = self.get_response(full_url, True, headers)
+        if result is None:
             return False
-        except urllib.error.HTTPError:
+        try:
+            with result:
+                if result.status_code == 416:
+                    # the part file is unusable, start again
+                    os.remove(part)
+                    return self.get_file(full_url, destination, callback)
+                result.raise_for_status()
+                if result.status_code != 206:
+                    # the server sent the whole file
+                    offset = 0
+                total = int(result.headers.get('Content-Length', 0))
+                if total:
+                    total += offset
+                started = time.monotonic()
+                done = offset
+                with open(part, 'ab' if offset else 'wb') as part_file:
+                    for chunk in result.iter_content(self.AMPACHE_CHUNK_SIZE):
+                        part_file.write(chunk)
+                        done += len(chunk)
+                        if callback:
+                            callback(done, total, (done - offset) / max(time.monotonic() - started, 0.001))
+            if total and done < total:
+                return False
+            os.replace(part, destination)
+        except requests.exceptions.RequestException:
             return False
-        except ValueError:
+        except OSError:
             return False
-        ampache_response = result.read()
-        result.close()
-        if self.AMPACHE_DEBUG:
-            url_response = ampache_response.decode('utf-8')
-            print(url_response)
-            print(full_url)
-            try:
-                text_file = open("docs/" + api_format + "-responses/" + method + "." + api_format, "w", encoding="utf-8")
-                text_file.write(url_response)
-                text_file.close()
-            except FileNotFoundError:
-                pass
-        return ampache_response
+        return True
 
     """
     -------------
@@ -357,7 +2205,9 @@ class API(object):
         if self.AMPACHE_API == 'json':
             json_data = json.loads(ampache_response.decode('utf-8'))
             if 'auth' in json_data:
-                self.AMPACHE_SESSION = json_data['auth']
+                self.set_session(json_data['auth'])
+                self.set_session_expire(json_data.get('session_expire'))
+                self.set_counts(json_data)
                 return json_data['auth']
             else:
                 return False
@@ -371,7 +2221,9 @@ class API(object):
                 token = tree.find('auth').text
             except AttributeError:
                 token = False
-            self.AMPACHE_SESSION = token
+            self.set_session(token)
+            self.set_session_expire(tree.findtext('session_expire'))
+            self.set_counts({child.tag: child.text for child in tree})
             return token
 
     def ping(self, ampache_url: str, ampache_api: str = False, version: str = '5.0.0'):
@@ -402,7 +2254,9 @@ class API(object):
             if 'session_expire' in json_data:
                 if not self.AMPACHE_URL:
                     self.AMPACHE_URL = ampache_url
-                self.AMPACHE_SESSION = ampache_api
+                self.set_session(ampache_api)
+                self.set_session_expire(json_data['session_expire'])
+                self.set_counts(json_data)
                 return ampache_api
             else:
                 return False
@@ -413,10 +2267,12 @@ class API(object):
             except ElementTree.ParseError:
                 return False
             try:
-                tree.find('session_expire').text
+                session_expire = tree.find('session_expire').text
                 if not self.AMPACHE_URL:
                     self.AMPACHE_URL = ampache_url
-                self.AMPACHE_SESSION = ampache_api
+                self.set_session(ampache_api)
+                self.set_session_expire(session_expire)
+                self.set_counts({child.tag: child.text for child in tree})
             except AttributeError:
                 return False
             return ampache_api
@@ -679,7 +2535,7 @@ class API(object):
                 'limit': str(limit),
                 'include': include}
         if not filter_str:
-            data.pop('filter_str')
+            data.pop('filter')
         if not add:
             data.pop('add')
         if not update:
@@ -1787,7 +3643,7 @@ class API(object):
             INPUTS
             * command     = (string) 'next', 'prev', 'stop', 'play', 'pause', 'add', 'volume_up',
                                      'volume_down', 'volume_mute', 'delete_all', 'skip', 'status'
-            * oid         = (integer) object_id //optional
+            * oid         = (integer) object_id, or the queue position (from 0) for 'skip' //optional
             * otype       = (string) 'Song', 'Video', 'Podcast_Episode', 'Channel',
                                      'Broadcast', 'Democratic', 'Live_Stream' //optional
             * clear       = (integer) 0,1 Clear the current playlist before adding //optional
@@ -1799,7 +3655,7 @@ class API(object):
                 'oid': oid,
                 'type': otype,
                 'clear': clear}
-        if not oid:
+        if oid is False:
             data.pop('oid')
         if not type:
             data.pop('type')
@@ -2251,7 +4107,7 @@ class API(object):
             return False
         return self.return_data(ampache_response)
 
-    def stream(self, object_id, object_type, destination):
+    def stream(self, object_id, object_type, destination, callback=None):
         """ stream
             MINIMUM_API_VERSION=400001
 
@@ -2261,6 +4117,7 @@ class API(object):
             * object_id   = (string) $song_id / $podcast_episode_id
             * object_type = (string) 'song'|'podcast'
             * destination = (string) full file path
+            * callback    = (function) called with (bytes_done, bytes_total, bytes_per_second) //optional
         """
         if not os.path.isdir(os.path.dirname(destination)):
             return False
@@ -2271,12 +4128,10 @@ class API(object):
                 'type': object_type}
         data = urllib.parse.urlencode(data)
         full_url = ampache_url + '?' + data
-        result = requests.get(full_url, allow_redirects=True)
-        open(destination, 'wb').write(result.content)
-        return True
+        return self.fetch_file(full_url, destination, callback)
 
     def download(self, object_id, object_type, destination,
-                 transcode='raw'):
+                 transcode='raw', callback=None, resume=False):
         """ download
             MINIMUM_API_VERSION=400001
 
@@ -2287,6 +4142,8 @@ class API(object):
             * object_type = (string) 'song'|'podcast'
             * destination = (string) full file path
             * transcode   = (string) 'mp3', 'ogg', etc. ('raw' / original by default) //optional
+            * callback    = (function) called with (bytes_done, bytes_total, bytes_per_second) //optional
+            * resume      = (boolean) continue a partial download if the server supports ranges //optional
         """
         os.makedirs(os.path.dirname(destination), exist_ok=True)
         ampache_url = self.AMPACHE_URL + '/server/' + self.AMPACHE_API + '.server.php'
@@ -2297,11 +4154,9 @@ class API(object):
                 'format': transcode}
         data = urllib.parse.urlencode(data)
         full_url = ampache_url + '?' + data
-        result = requests.get(full_url, allow_redirects=True)
-        open(destination, 'wb').write(result.content)
-        return True
+        return self.fetch_file(full_url, destination, callback, resume)
 
-    def get_art(self, object_id, object_type, destination):
+    def get_art(self, object_id, object_type, destination, callback=None):
         """ get_art
             MINIMUM_API_VERSION=400001
 
@@ -2311,6 +4166,7 @@ class API(object):
             * object_id   = (string) $song_id / $podcast_episode_id
             * object_type = (string) 'song', 'artist', 'album', 'playlist', 'search', 'podcast'
             * destination = (string) output file path
+            * callback    = (function) called with (bytes_done, bytes_total, bytes_per_second) //optional
         """
         if not os.path.isdir(os.path.dirname(destination)):
             return False
@@ -2321,9 +4177,7 @@ class API(object):
                 'type': object_type}
         data = urllib.parse.urlencode(data)
         full_url = ampache_url + '?' + data
-        result = requests.get(full_url, allow_redirects=True)
-        open(destination, 'wb').write(result.content)
-        return True
+        return self.fetch_file(full_url, destination, callback)
 
     def user_create(self, username: str, password: str, email: str,
                     fullname: str = False, disable=False):
@@ -2957,6 +4811,214 @@ class API(object):
             return False
         return self.return_data(ampache_response)
 
+    """
+    ------------------
+    ITERATOR FUNCTIONS
+    ------------------
+    """
+
+    def iter_artists(self, filter_str: str = False, add: int = False, update: int = False, include=False,
+                     page_size: int = 0):
+        """ iter_artists
+
+            Page through the artists one object at a time
+
+            INPUTS
+            * filter_str  = (string) search the name of an artist //optional
+            * add         = (integer) UNIXTIME() //optional
+            * update      = (integer) UNIXTIME() //optional
+            * include     = (string) 'albums', 'songs' //optional
+            * page_size   = (integer) objects per request //optional
+        """
+        return self.paginate(self.artists, 'artist', page_size,
+                             filter_str=filter_str, add=add, update=update, include=include)
+
+    def iter_albums(self, filter_str: str = False, exact=False, add: int = False, update: int = False,
+                    include=False, page_size: int = 0):
+        """ iter_albums
+
+            Page through the albums one object at a time
+
+            INPUTS
+            * filter_str  = (string) search the name of an album //optional
+            * exact       = (integer) 0,1, if true filter is exact rather then fuzzy //optional
+            * add         = (integer) UNIXTIME() //optional
+            * update      = (integer) UNIXTIME() //optional
+            * include     = (string) 'songs' //optional
+            * page_size   = (integer) objects per request //optional
+        """
+        return self.paginate(self.albums, 'album', page_size,
+                             filter_str=filter_str, exact=exact, add=add, update=update, include=include)
+
+    def iter_songs(self, filter_str: str = False, exact: int = False, add: int = False, update: int = False,
+                   page_size: int = 0):
+        """ iter_songs
+
+            Page through the songs one object at a time
+
+            INPUTS
+            * filter_str  = (string) search the name of a song //optional
+            * exact       = (integer) 0,1, if true filter is exact rather then fuzzy //optional
+            * add         = (integer) UNIXTIME() //optional
+            * update      = (integer) UNIXTIME() //optional
+            * page_size   = (integer) objects per request //optional
+        """
+        return self.paginate(self.songs, 'song', page_size,
+                             filter_str=filter_str, exact=exact, add=add, update=update)
+
+    def iter_genres(self, filter_str: str = False, exact: int = False, page_size: int = 0):
+        """ iter_genres
+
+            Page through the genres one object at a time
+
+            INPUTS
+            * filter_str  = (string) search the name of a genre //optional
+            * exact       = (integer) 0,1, if true filter is exact rather then fuzzy //optional
+            * page_size   = (integer) objects per request //optional
+        """
+        return self.paginate(self.genres, 'genre', page_size, filter_str=filter_str, exact=exact)
+
+    def iter_playlists(self, filter_str: str = False, exact: int = False, page_size: int = 0):
+        """ iter_playlists
+
+            Page through the playlists one object at a time
+
+            INPUTS
+            * filter_str  = (string) search the name of a playlist //optional
+            * exact       = (integer) 0,1, if true filter is exact rather then fuzzy //optional
+            * page_size   = (integer) objects per request //optional
+        """
+        return self.paginate(self.playlists, 'playlist', page_size, filter_str=filter_str, exact=exact)
+
+    def iter_artist_albums(self, filter_id: int, page_size: int = 0):
+        """ iter_artist_albums
+
+            Page through the albums of an artist one object at a time
+
+            INPUTS
+            * filter_id   = (integer) $artist_id
+            * page_size   = (integer) objects per request //optional
+        """
+        return self.paginate(self.artist_albums, 'album', page_size, filter_id=filter_id)
+
+    def iter_artist_songs(self, filter_id: int, page_size: int = 0):
+        """ iter_artist_songs
+
+            Page through the songs of an artist one object at a time
+
+            INPUTS
+            * filter_id   = (integer) $artist_id
+            * page_size   = (integer) objects per request //optional
+        """
+        return self.paginate(self.artist_songs, 'song', page_size, filter_id=filter_id)
+
+    def iter_album_songs(self, filter_id: int, page_size: int = 0):
+        """ iter_album_songs
+
+            Page through the songs of an album one object at a time
+
+            INPUTS
+            * filter_id   = (integer) $album_id
+            * page_size   = (integer) objects per request //optional
+        """
+        return self.paginate(self.album_songs, 'song', page_size, filter_id=filter_id)
+
+    def iter_genre_artists(self, filter_id: int, page_size: int = 0):
+        """ iter_genre_artists
+
+            Page through the artists of a genre one object at a time
+
+            INPUTS
+            * filter_id   = (integer) $genre_id
+            * page_size   = (integer) objects per request //optional
+        """
+        return self.paginate(self.genre_artists, 'artist', page_size, filter_id=filter_id)
+
+    def iter_genre_albums(self, filter_id: int, page_size: int = 0):
+        """ iter_genre_albums
+
+            Page through the albums of a genre one object at a time
+
+            INPUTS
+            * filter_id   = (integer) $genre_id
+            * page_size   = (integer) objects per request //optional
+        """
+        return self.paginate(self.genre_albums, 'album', page_size, filter_id=filter_id)
+
+    def iter_genre_songs(self, filter_id: int, page_size: int = 0):
+        """ iter_genre_songs
+
+            Page through the songs of a genre one object at a time
+
+            INPUTS
+            * filter_id   = (integer) $genre_id
+            * page_size   = (integer) objects per request //optional
+        """
+        return self.paginate(self.genre_songs, 'song', page_size, filter_id=filter_id)
+
+    def iter_playlist_songs(self, filter_id: int, page_size: int = 0):
+        """ iter_playlist_songs
+
+            Page through the songs of a playlist one object at a time
+
+            INPUTS
+            * filter_id   = (integer) $playlist_id
+            * page_size   = (integer) objects per request //optional
+        """
+        return self.paginate(self.playlist_songs, 'song', page_size, filter_id=filter_id)
+
+    def iter_podcast_episodes(self, filter_id: int, page_size: int = 0):
+        """ iter_podcast_episodes
+
+            Page through the episodes of a podcast one object at a time
+
+            INPUTS
+            * filter_id   = (string) UID of podcast
+            * page_size   = (integer) objects per request //optional
+        """
+        return self.paginate(self.podcast_episodes, 'podcast_episode', page_size, filter_id=filter_id)
+
+    def iter_search_songs(self, filter_str, page_size: int = 0):
+        """ iter_search_songs
+
+            Page through the songs matching a search one object at a time
+
+            INPUTS
+            * filter_str  = (string) search the name of a song
+            * page_size   = (integer) objects per request //optional
+        """
+        return self.paginate(self.search_songs, 'song', page_size, filter_str=filter_str)
+
+    def iter_deleted_songs(self, page_size: int = 0):
+        """ iter_deleted_songs
+
+            Page through the deleted songs one object at a time
+
+            INPUTS
+            * page_size   = (integer) objects per request //optional
+        """
+        return self.paginate(self.deleted_songs, 'deleted_song', page_size)
+
+    def iter_deleted_podcast_episodes(self, page_size: int = 0):
+        """ iter_deleted_podcast_episodes
+
+            Page through the deleted podcast episodes one object at a time
+
+            INPUTS
+            * page_size   = (integer) objects per request //optional
+        """
+        return self.paginate(self.deleted_podcast_episodes, 'deleted_podcast_episode', page_size)
+
+    def iter_deleted_videos(self, page_size: int = 0):
+        """ iter_deleted_videos
+
+            Page through the deleted videos one object at a time
+
+            INPUTS
+            * page_size   = (integer) objects per request //optional
+        """
+        return self.paginate(self.deleted_videos, 'deleted_video', page_size)
+
     """
     --------------------
     BACKCOMPAT FUNCTIONS
@@ -2967,3 +5029,225 @@ class API(object):
     tag_artists = genre_artists
     tag_albums = genre_albums
     tag_songs = genre_songs
+
+
+class DownloadManager(object):
+    """ DownloadManager
+
+        Download many songs or podcast episodes on a bounded worker pool.
+        Partial files are resumed with Range requests and failed downloads
+        are retried with exponential backoff.
+
+        e.g. manager = DownloadManager(api)
+             manager.add_list([(song_id, 'song', '/music/' + song_id + '.mp3') for song_id in song_ids])
+             results = manager.wait()
+    """
+
+    def __init__(self, api: API, workers: int = 4, retries: int = 3, backoff: float = 1.0, transcode: str = 'raw'):
+        self.api = api
+        self.retries = retries
+        self.backoff = backoff
+        self.transcode = transcode
+        if self.api.AMPACHE_POOL_SIZE < workers:
+            self.api.set_pool(workers, self.api.AMPACHE_POOL_IDLE)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ampache-download')
+        self.futures = list()
+        self.lock = threading.Lock()
+        self.queued = 0
+        self.active = 0
+        self.completed = 0
+        self.failed = 0
+        self.bytes = 0
+        self.started = time.monotonic()
+
+    def add(self, object_id, object_type: str, destination: str):
+        """ add
+
+            queue a download and return its future (result is True when the file was saved)
+
+            INPUTS
+            * object_id   = (string) $song_id / $podcast_episode_id
+            * object_type = (string) 'song'|'podcast'
+            * destination = (string) full file path
+        """
+        with self.lock:
+            self.queued += 1
+        future = self.executor.submit(self.run, object_id, object_type, destination)
+        self.futures.append((object_id, object_type, destination, future))
+        return future
+
+    def add_list(self, downloads):
+        """ add_list
+
+            queue a list of (object_id, object_type, destination)
+        """
+        for object_id, object_type, destination in downloads:
+            self.add(object_id, object_type, destination)
+
+    def run(self, object_id, object_type: str, destination: str):
+        """ run
+
+            download one file, resuming and retrying until it succeeds or runs out of retries
+        """
+        with self.lock:
+            self.queued -= 1
+            self.active += 1
+        progress = [0]
+
+        def count_bytes(done, total, rate):
+            with self.lock:
+                self.bytes += max(done - progress[0], 0)
+            progress[0] = done
+
+        result = False
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(self.backoff * 2 ** (attempt - 1) * (0.5 + random.random()))
+            # a resumed download reports the bytes that were already on disk
+            progress[0] = os.path.getsize(destination + '.part') if os.path.isfile(destination + '.part') else 0
+            result = self.api.download(object_id, object_type, destination, self.transcode, count_bytes, True)
+            if result:
+                break
+        with self.lock:
+            self.active -= 1
+            if result:
+                self.completed += 1
+            else:
+                self.failed += 1
+        return result
+
+    def stats(self):
+        """ stats
+
+            return the queue depth, progress counters and throughput in bytes per second
+        """
+        with self.lock:
+            elapsed = max(time.monotonic() - self.started, 0.001)
+            return {'queued': self.queued,
+                    'active': self.active,
+                    'completed': self.completed,
+                    'failed': self.failed,
+                    'bytes': self.bytes,
+                    'bytes_per_second': self.bytes / elapsed}
+
+    def wait(self):
+        """ wait
+
+            block until every queued download has finished and return
+            a list of (object_id, object_type, destination, result)
+        """
+        return [(object_id, object_type, destination, future.result())
+                for object_id, object_type, destination, future in self.futures]
+
+    def close(self):
+        """ close
+
+            stop accepting downloads once the queued ones are done
+        """
+        self.executor.shutdown(wait=True)
+
+
+class AsyncAPI(object):
+    """ AsyncAPI
+
+        asyncio version of API. Every API action is available as a coroutine and
+        runs on a bounded worker pool sharing one keep-alive connection pool.
+        The paging and streaming generators are async generators that read on the pool.
+
+        e.g. albums = await asyncio.gather(*[client.album(album_id) for album_id in album_ids])
+             async for song in client.iter_songs():
+    """
+    # API methods that don't touch the network and stay synchronous
+    helpers = ('set_format', 'set_debug', 'set_user', 'set_key', 'set_url', 'set_pool', 'get_pool',
+               'close_pool', 'test_result', 'return_data', 'get_id_list', 'get_object_list', 'write_xml',
+               'get_message', 'set_session', 'set_session_expire', 'get_error_code', 'is_auth_error', 'write_json',
+               'encrypt_password', 'encrypt_string', 'set_page_size', 'get_page_objects',
+               'set_counts', 'set_cache', 'get_records',
+               'get_id_array', 'set_single_flight', 'is_shared',
+               'set_limiter', 'is_available',
+               'set_timeout', 'set_retries', 'set_breaker',
+               'set_metrics', 'get_metrics', 'write_metrics',
+               'set_recorder', 'get_recorder', 'set_trace')
+    # API methods that return blocking iterators, these become async generators (as do all iter_*)
+    iterators = ('paginate', 'stream_objects', 'stream_records')
+
+    def __init__(self, api: API = None, concurrency: int = 10):
+        self.api = api if api else API()
+        self.concurrency = concurrency
+        if self.api.AMPACHE_POOL_SIZE < concurrency:
+            self.api.set_pool(concurrency, self.api.AMPACHE_POOL_IDLE)
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='ampache')
+        self.semaphores = dict()
+
+    def __getattr__(self, name):
+        attribute = getattr(self.api, name)
+        if name.startswith('_') or name in self.helpers or not callable(attribute):
+            return attribute
+        if name in self.iterators or name.startswith('iter_'):
+            @functools.wraps(attribute)
+            def objects(*args, **kwargs):
+                return self.iterate(attribute, *args, **kwargs)
+            return objects
+
+        @functools.wraps(attribute)
+        async def action(*args, **kwargs):
+            return await self.run(attribute, *args, **kwargs)
+        return action
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        self.close()
+
+    def get_semaphore(self):
+        """ get_semaphore
+
+            return the concurrency limit for the running event loop
+        """
+        loop = asyncio.get_running_loop()
+        if loop not in self.semaphores:
+            self.semaphores[loop] = asyncio.Semaphore(self.concurrency)
+        return self.semaphores[loop]
+
+    async def run(self, method, *args, **kwargs):
+        """ run
+
+            await a blocking API method on the worker pool
+
+            INPUTS
+            * method = (function) bound API method
+        """
+        async with self.get_semaphore():
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, functools.partial(method, *args, **kwargs))
+
+    async def iterate(self, method, *args, **kwargs):
+        """ iterate
+
+            async generator over a blocking API iterator, each batch of objects is read on the worker pool
+
+            INPUTS
+            * method = (function) bound API method that returns an iterator
+        """
+        iterator = iter(await self.run(method, *args, **kwargs))
+        try:
+            while True:
+                batch = await self.run(list, itertools.islice(iterator, self.api.AMPACHE_PAGE_SIZE))
+                for data_object in batch:
+                    yield data_object
+                if len(batch) < self.api.AMPACHE_PAGE_SIZE:
+                    return
+        finally:
+            # closing a paging generator waits for its prefetch
+            close = getattr(iterator, 'close', None)
+            if close:
+                await asyncio.get_running_loop().run_in_executor(self.executor, close)
+
+    def close(self):
+        """ close
+
+            stop the worker pool and close every pooled connection
+        """
+        self.executor.shutdown(wait=False)
+        self.api.close_pool()
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+
+"""    Copyright (C)2021
+       Lachlan de Waard <lachlan.00@gmail.com>
+       --------------------------------------------
+       ampache-localplay: ampache.API benchmarks
+       --------------------------------------------
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+ Measure requests/sec, p50/p99 latency and peak memory for each API action and format
+ against ampachemock.py (started in a separate process unless --url is given).
+
+ e.g. python3 ampachebench.py --songs 100000 --save before.json
+      python3 ampachebench.py --songs 100000 --compare before.json
+"""
+
+import ampache
+import argparse
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from concurrent.futures import ThreadPoolExecutor
+
+FORMATS = ('json', 'xml')
+
+
+def count(items):
+    total = 0
+    for _ in items:
+        total += 1
+    return total
+
+
+# name: (function(api, state), divides --iterations for the slower cases)
+CASES = {'handshake': (lambda api, state: api.handshake(state['url'], 'benchmark'), 1),
+         'ping': (lambda api, state: api.ping(state['url'], api.AMPACHE_SESSION), 1),
+         'songs_page': (lambda api, state: api.songs(limit=500), 1),
+         'songs_all': (lambda api, state: api.songs(), 10),
+         'stream_objects': (lambda api, state: count(api.stream_objects(api.songs, 'song')), 10),
+         'stream_records': (lambda api, state: count(api.stream_records(api.songs, 'song')), 10),
+         'iter_songs': (lambda api, state: count(api.iter_songs()), 10),
+         'fetch_all': (lambda api, state: len(api.fetch_all('song')), 10),
+         'playlists': (lambda api, state: api.playlists(), 1),
+         'playlist_songs': (lambda api, state: api.playlist_songs(1), 1),
+         'localplay_status': (lambda api, state: api.localplay('status'), 1),
+         'localplay_next': (lambda api, state: api.localplay('next'), 1),
+         'stream': (lambda api, state: api.stream(1, 'song', os.path.join(state['folder'],
+                                                                           str(threading.get_ident()))), 1)}
+
+
+def get_port():
+    with socket.socket() as free:
+        free.bind(('127.0.0.1', 0))
+        return free.getsockname()[1]
+
+
+def add_mock_arguments(parser):
+    """ add the ampachemock.py settings used by start_mock """
+    parser.add_argument('--songs', type=int, default=10000)
+    parser.add_argument('--playlist-size', type=int, default=1000)
+    parser.add_argument('--text-size', type=int, default=0)
+    parser.add_argument('--file-size', type=int, default=4194304)
+    parser.add_argument('--latency', type=float, default=0)
+    parser.add_argument('--jitter', type=float, default=0)
+    parser.add_argument('--error-rate', type=float, default=0)
+    parser.add_argument('--api-error-rate', type=float, default=0)
+
+
+def start_mock(args):
+    """ run ampachemock.py in its own process so it doesn't share the GIL or the memory tracing """
+    port = get_port()
+    command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ampachemock.py'),
+               '--port', str(port), '--songs', str(args.songs), '--playlist-size', str(args.playlist_size),
+               '--text-size', str(args.text_size), '--file-size', str(args.file_size),
+               '--latency', str(args.latency), '--jitter', str(args.jitter),
+               '--error-rate', str(args.error_rate), '--api-error-rate', str(args.api_error_rate)]
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            socket.create_connection(('127.0.0.1', port), 0.1).close()
+            return process, 'http://127.0.0.1:' + str(port)
+        except OSError:
+            time.sleep(0.05)
+    process.kill()
+    raise SystemExit('ampachemock.py did not start')
+
+
+def get_api(api_format: str, args, url: str):
+    api = ampache.API()
+    api.AMPACHE_API = api_format
+    if not args.cache:
+        api.set_cache(0)
+    if not args.limiter:
+        api.set_limiter(False)
+    if not api.handshake(url, args.key, args.user):
+        raise SystemExit('handshake failed for ' + url)
+    return api
+
+
+def get_percentile(times, percent: float):
+    """ nearest rank percentile of a sorted list """
+    return times[min(len(times) - 1, max(0, int(round(percent / 100 * len(times) + 0.5)) - 1))]
+
+
+def run_case(api, function, state: dict, iterations: int, concurrency: int):
+    """ return the timing and memory results for one case """
+    function(api, state)
+    times = []
+    errors = 0
+
+    def timed(_):
+        started = time.perf_counter()
+        result = function(api, state)
+        return time.perf_counter() - started, result is False
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        for elapsed, failed in executor.map(timed, range(iterations)):
+            times.append(elapsed)
+            errors += failed
+    wall = time.perf_counter() - started
+    # measure memory on its own, tracing slows the code down
+    tracemalloc.start()
+    function(api, state)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    times.sort()
+    return {'iterations': iterations, 'errors': errors, 'rps': iterations / wall,
+            'p50': get_percentile(times, 50) * 1000, 'p99': get_percentile(times, 99) * 1000,
+            'peak_kib': peak / 1024}
+
+
+def print_results(results: dict, baseline: dict = None):
+    header = '%-8s %-18s %10s %10s %10s %12s %7s' % ('format', 'action', 'req/s', 'p50 ms', 'p99 ms', 'peak KiB',
+                                                      'errors')
+    print(header)
+    print('-' * len(header))
+    for api_format, cases in results.items():
+        for name, result in cases.items():
+            line = '%-8s %-18s %10.1f %10.2f %10.2f %12.1f %7d' % (api_format, name, result['rps'], result['p50'],
+                                                                   result['p99'], result['peak_kib'],
+                                                                   result['errors'])
+            old = (baseline or dict()).get(api_format, dict()).get(name)
+            if old:
+                line += '  (req/s %+.0f%%, p50 %+.0f%%, peak %+.0f%%)' % (
+                    get_change(old['rps'], result['rps']), get_change(old['p50'], result['p50']),
+                    get_change(old['peak_kib'], result['peak_kib']))
+            print(line)
+
+
+def get_change(old: float, new: float):
+    return (new - old) / old * 100 if old else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark ampache.API against a local mock server')
+    parser.add_argument('--url', help='benchmark a running server instead of starting ampachemock.py')
+    parser.add_argument('--key', default='benchmark', help='api key or password for --url')
+    parser.add_argument('--user', default=False, help='username for --url')
+    parser.add_argument('--format', choices=FORMATS, action='append', help='only test these formats')
+    parser.add_argument('--case', choices=sorted(CASES), action='append', help='only run these cases')
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--concurrency', type=int, default=1, help='threads sending requests')
+    parser.add_argument('--cache', action='store_true', help='keep the response cache on')
+    parser.add_argument('--limiter', action='store_true', help='keep the request limiter on')
+    add_mock_arguments(parser)
+    parser.add_argument('--save', help='write the results to a json file')
+    parser.add_argument('--compare', help='show the change from a file written with --save')
+    args = parser.parse_args()
+
+    process = None
+    url = args.url
+    if not url:
+        process, url = start_mock(args)
+    folder = tempfile.mkdtemp(prefix='ampachebench-')
+    state = {'url': url, 'folder': folder}
+    results = dict()
+    try:
+        for api_format in args.format or FORMATS:
+            api = get_api(api_format, args, url)
+            results[api_format] = dict()
+            for name in args.case or CASES:
+                function, divisor = CASES[name]
+                iterations = max(3, args.iterations // divisor)
+                results[api_format][name] = run_case(api, function, state, iterations, args.concurrency)
+            api.close_pool()
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+        if process:
+            process.terminate()
+            process.wait()
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as baseline_file:
+            baseline = json.load(baseline_file)
+    print_results(results, baseline)
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as results_file:
+            json.dump(results, results_file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
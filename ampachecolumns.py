@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+
+"""    Copyright (C)2021
+       Lachlan de Waard <lachlan.00@gmail.com>
+       -------------------------------------------------
+       ampache-localplay: columnar ampache result sets
+       -------------------------------------------------
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import ampache
+import operator
+
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# typecodes for each column kind, text is stored as codes into a list of distinct values
+TYPECODES = {'int': 'q', 'float': 'd', 'text': 'l'}
+OPERATORS = {'==': operator.eq, '!=': operator.ne, '<': operator.lt, '<=': operator.le,
+             '>': operator.gt, '>=': operator.ge}
+
+
+class ColumnSet(object):
+    """ Store api results one typed array per field for fast filtering and aggregation.
+        NumPy is used for the vectorized operations when it is installed.
+
+        e.g. songs = ColumnSet.from_records(api.stream_records(api.songs, 'song'))
+             plays_by_year = songs.group_by('year', 'playcount', 'sum')
+    """
+
+    def __init__(self, kinds: dict):
+        self.kinds = dict(kinds)
+        self.columns = {name: array(TYPECODES[kind]) for name, kind in self.kinds.items()}
+        # distinct values and their codes for each text column
+        self.values = {name: [] for name, kind in self.kinds.items() if kind == 'text'}
+        self.codes = {name: {} for name in self.values}
+
+    @classmethod
+    def from_records(cls, records, fields=None):
+        """ build from typed records (ampache.Song, Album, etc). Genres keep their first name. """
+        result = None
+        for record in records:
+            if result is None:
+                if not fields:
+                    fields = record.__slots__
+                kinds = dict()
+                for name in fields:
+                    value = getattr(record, name)
+                    kinds[name] = 'int' if isinstance(value, int) else 'float' if isinstance(value, float) else 'text'
+                result = cls(kinds)
+            result.append({name: getattr(record, name) for name in fields})
+        return result if result is not None else cls(dict())
+
+    @classmethod
+    def from_objects(cls, data_objects, kinds: dict):
+        """ build from json dicts or xml Elements, kinds is {field: 'int'|'float'|'text'} """
+        result = cls(kinds)
+        for data_object in data_objects:
+            # a copy, json objects are returned as they are and belong to the caller
+            values = dict(ampache.get_record_values(data_object))
+            for name, value in values.items():
+                if isinstance(value, list):
+                    value = value[0] if value else None
+                if isinstance(value, dict):
+                    value = value.get('name')
+                values[name] = value
+            result.append(values)
+        return result
+
+    def append(self, values: dict):
+        for name, kind in self.kinds.items():
+            value = values.get(name)
+            if kind == 'text':
+                if isinstance(value, tuple):
+                    value = value[0] if value else ''
+                value = '' if value is None else str(value)
+                code = self.codes[name].get(value)
+                if code is None:
+                    code = self.codes[name][value] = len(self.values[name])
+                    self.values[name].append(value)
+                self.columns[name].append(code)
+            elif kind == 'float':
+                self.columns[name].append(float(value or 0))
+            else:
+                self.columns[name].append(ampache.to_int(value))
+
+    def __len__(self):
+        for column in self.columns.values():
+            return len(column)
+        return 0
+
+    def column(self, name: str):
+        """ return a column as a numpy array (or the raw array without numpy). Text columns are codes. """
+        if numpy is not None:
+            return numpy.frombuffer(self.columns[name], dtype=self.columns[name].typecode)
+        return self.columns[name]
+
+    def get_values(self, name: str):
+        """ return a column as python values with text decoded """
+        if self.kinds[name] == 'text':
+            return [self.values[name][code] for code in self.columns[name]]
+        return self.columns[name].tolist()
+
+    def mask(self, name: str, op: str, value):
+        """ return a boolean mask of the rows where `name op value` e.g. mask('year', '>=', 2000) """
+        if self.kinds[name] == 'text':
+            if op not in ('==', '!='):
+                raise ValueError('text columns only support == and !=')
+            value = self.codes[name].get(str(value), -1)
+        column = self.column(name)
+        if numpy is not None:
+            return OPERATORS[op](column, value)
+        compare = OPERATORS[op]
+        return array('b', (compare(item, value) for item in column))
+
+    def filter(self, mask):
+        """ return a new ColumnSet with only the rows where mask is true """
+        result = ColumnSet(self.kinds)
+        result.values = self.values
+        result.codes = self.codes
+        for name, column in self.columns.items():
+            if numpy is not None:
+                result.columns[name].frombytes(self.column(name)[numpy.asarray(mask, dtype=bool)].tobytes())
+            else:
+                result.columns[name] = array(column.typecode, (item for item, keep in zip(column, mask) if keep))
+        return result
+
+    def aggregate(self, field: str, how: str = 'sum'):
+        """ return one value for a column, how is 'sum'|'count'|'mean'|'min'|'max' """
+        column = self.column(field)
+        if how == 'count':
+            return len(column)
+        if not len(column):
+            return 0
+        if numpy is not None:
+            return getattr(numpy, how)(column).item()
+        if how == 'mean':
+            return sum(column) / len(column)
+        return {'sum': sum, 'min': min, 'max': max}[how](column)
+
+    def group_by(self, key: str, field: str = '', how: str = 'count'):
+        """ return {key value: aggregate of field} e.g. group_by('artist', 'time', 'sum') """
+        keys = self.column(key)
+        if numpy is not None:
+            groups, inverse = numpy.unique(keys, return_inverse=True)
+            if how == 'count':
+                results = numpy.bincount(inverse)
+            elif how in ('sum', 'mean'):
+                results = numpy.bincount(inverse, weights=self.column(field))
+                if how == 'mean':
+                    results = results / numpy.bincount(inverse)
+                elif self.kinds[field] == 'int':
+                    results = results.astype('q')
+            else:
+                column = self.column(field)
+                results = numpy.full(len(groups), column.max() if how == 'min' else column.min(), dtype=column.dtype)
+                getattr(numpy, 'minimum' if how == 'min' else 'maximum').at(results, inverse, column)
+            groups = groups.tolist()
+            results = results.tolist()
+        else:
+            totals = dict()
+            counts = dict()
+            values = self.columns[field] if field else keys
+            for group, value in zip(keys, values):
+                counts[group] = counts.get(group, 0) + 1
+                if how in ('sum', 'mean'):
+                    totals[group] = totals.get(group, 0) + value
+                elif how == 'min':
+                    totals[group] = min(totals.get(group, value), value)
+                elif how == 'max':
+                    totals[group] = max(totals.get(group, value), value)
+            groups = list(counts)
+            if how == 'count':
+                results = [counts[group] for group in groups]
+            elif how == 'mean':
+                results = [totals[group] / counts[group] for group in groups]
+            else:
+                results = [totals[group] for group in groups]
+        if self.kinds[key] == 'text':
+            groups = [self.values[key][group] for group in groups]
+        return dict(zip(groups, results))
@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+
+"""    Copyright (C)2021
+       Lachlan de Waard <lachlan.00@gmail.com>
+       ----------------------------------------------
+       ampache-localplay: local ampache library store
+       ----------------------------------------------
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+try:
+    import gi
+    gi.require_version('GdkPixbuf', '2.0')
+    from gi.repository import GdkPixbuf, GLib
+except (ImportError, ValueError):
+    GdkPixbuf = None
+
+# object types mirrored locally, each is listed with API.iter_<type>s
+LIBRARY_TYPES = ('artist', 'album', 'song', 'playlist')
+# types that can be fetched as a delta with the add/update filters
+DELTA_TYPES = ('artist', 'album', 'song')
+# rows written per transaction while syncing
+SYNC_BATCH = 1000
+# seconds subtracted from the sync time to allow for clock differences with the server
+SYNC_SKEW = 300
+
+
+class LibraryStore(object):
+    """ Keep a local SQLite copy of the Ampache library and sync it incrementally """
+
+    def __init__(self, ampache_api, database: str):
+        self.ampache = ampache_api
+        self.database = database
+        folder = os.path.dirname(database)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(database, check_same_thread=False)
+        with self.lock, self.connection:
+            for object_type in LIBRARY_TYPES:
+                self.connection.execute('CREATE TABLE IF NOT EXISTS ' + object_type +
+                                        ' (id INTEGER PRIMARY KEY, name TEXT, data TEXT)')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+
+    @staticmethod
+    def get_object_dict(data_object):
+        """ return a json object as is or convert an xml Element into a dict """
+        if isinstance(data_object, dict):
+            return data_object
+        result = dict(data_object.attrib)
+        for child in data_object:
+            if child.attrib and child.text:
+                result[child.tag] = dict(child.attrib, name=child.text)
+            elif child.attrib:
+                result[child.tag] = dict(child.attrib)
+            else:
+                result[child.tag] = child.text
+        return result
+
+    def get_meta(self, key: str, default=False):
+        with self.lock:
+            row = self.connection.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return default
+        return row[0]
+
+    def set_meta(self, key: str, value):
+        with self.lock, self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, str(value)))
+
+    def store(self, object_type: str, data_objects, replace: bool = False):
+        """ insert or update objects, optionally replacing everything already stored for the type.
+            A replacement is staged in a temporary table and swapped in with one transaction after
+            the last object has arrived, so a pull that fails part way leaves the stored objects alone.
+        """
+        table = object_type
+        if replace:
+            table = 'staged_' + object_type
+            with self.lock, self.connection:
+                self.connection.execute('CREATE TEMP TABLE IF NOT EXISTS ' + table +
+                                        ' (id INTEGER PRIMARY KEY, name TEXT, data TEXT)')
+                self.connection.execute('DELETE FROM ' + table)
+        count = 0
+        rows = []
+        for data_object in data_objects:
+            data = self.get_object_dict(data_object)
+            rows.append((int(data['id']), data.get('title', data.get('name', '')), json.dumps(data)))
+            if len(rows) >= SYNC_BATCH:
+                count += self.write(table, rows)
+                rows = []
+        count += self.write(table, rows)
+        if replace:
+            with self.lock, self.connection:
+                self.connection.execute('DELETE FROM ' + object_type)
+                self.connection.execute('INSERT INTO ' + object_type + ' (id, name, data) SELECT id, name, data FROM ' +
+                                        table)
+                self.connection.execute('DELETE FROM ' + table)
+        return count
+
+    def write(self, object_type: str, rows):
+        with self.lock, self.connection:
+            self.connection.executemany('INSERT OR REPLACE INTO ' + object_type + ' (id, name, data) VALUES (?, ?, ?)',
+                                        rows)
+        return len(rows)
+
+    def remove(self, object_type: str, object_ids):
+        with self.lock, self.connection:
+            self.connection.executemany('DELETE FROM ' + object_type + ' WHERE id = ?',
+                                        [(int(object_id),) for object_id in object_ids])
+
+    def sync(self, object_types=LIBRARY_TYPES):
+        """ pull each type in full the first time, then only what was added, updated or deleted since.
+            A failed pull raises ampache.PageError and that type keeps its stored objects and last sync time.
+        """
+        started = int(time.time())
+        changed = dict()
+        for object_type in object_types:
+            last_sync = int(self.get_meta('last_sync_' + object_type, 0))
+            items = getattr(self.ampache, 'iter_' + object_type + 's')
+            if last_sync and object_type in DELTA_TYPES:
+                count = self.store(object_type, items(add=last_sync))
+                count += self.store(object_type, items(update=last_sync))
+                if object_type == 'song':
+                    changed['deleted_song'] = self.remove_deleted_songs(last_sync)
+            else:
+                count = self.store(object_type, items(), True)
+            changed[object_type] = count
+            self.set_meta('last_sync_' + object_type, started - SYNC_SKEW)
+        return changed
+
+    def remove_deleted_songs(self, since: int):
+        """ remove songs the server has deleted since the last sync """
+        deleted = []
+        for data_object in self.ampache.iter_deleted_songs():
+            data = self.get_object_dict(data_object)
+            if int(data.get('delete_time', since)) >= since:
+                deleted.append(data['id'])
+        self.remove('song', deleted)
+        return len(deleted)
+
+    def get(self, object_type: str, object_id):
+        with self.lock:
+            row = self.connection.execute('SELECT data FROM ' + object_type + ' WHERE id = ?',
+                                          (int(object_id),)).fetchone()
+        if row is None:
+            return False
+        return json.loads(row[0])
+
+    def get_all(self, object_type: str):
+        """ return every stored object of a type sorted by name """
+        with self.lock:
+            rows = self.connection.execute('SELECT data FROM ' + object_type + ' ORDER BY name').fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def count(self, object_type: str):
+        with self.lock:
+            return self.connection.execute('SELECT COUNT(*) FROM ' + object_type).fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+class ArtCache(object):
+    """ Keep downloaded art on disk, shared between objects with identical images and limited in size """
+
+    def __init__(self, ampache_api, folder: str, max_bytes: int = 104857600):
+        self.ampache = ampache_api
+        self.folder = folder
+        self.max_bytes = max_bytes
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(os.path.join(folder, 'art.db'), check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS art (object_type TEXT, object_id TEXT, hash TEXT, ' +
+                                    'PRIMARY KEY (object_type, object_id))')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS image (hash TEXT PRIMARY KEY, size INTEGER, ' +
+                                    'last_used REAL)')
+
+    def get_path(self, image_hash: str, size: int = 0):
+        """ return the file path for an image or one of its thumbnails """
+        name = image_hash if not size else image_hash + '_' + str(size) + '.png'
+        return os.path.join(self.folder, image_hash[:2], name)
+
+    def get(self, object_type: str, object_id, size: int = 0):
+        """ return the path to the art for an object, downloading it only if it isn't cached
+
+            INPUTS
+            * object_type = (string) 'song', 'artist', 'album', 'playlist', 'search', 'podcast'
+            * object_id   = (string) $object_id
+            * size        = (integer) longest side of a scaled thumbnail, 0 for the original //optional
+        """
+        object_id = str(object_id)
+        with self.lock:
+            row = self.connection.execute('SELECT hash FROM art WHERE object_type = ? AND object_id = ?',
+                                          (object_type, object_id)).fetchone()
+        if row and os.path.isfile(self.get_path(row[0])):
+            image_hash = row[0]
+        else:
+            image_hash = self.fetch(object_type, object_id)
+            if not image_hash:
+                return False
+        with self.lock, self.connection:
+            self.connection.execute('UPDATE image SET last_used = ? WHERE hash = ?', (time.time(), image_hash))
+        if size:
+            return self.get_thumbnail(image_hash, size)
+        return self.get_path(image_hash)
+
+    def fetch(self, object_type: str, object_id: str):
+        """ download art and store it under the hash of its content """
+        download = os.path.join(self.folder, 'download-' + str(threading.get_ident()))
+        if not self.ampache.get_art(object_id, object_type, download):
+            return False
+        digest = hashlib.sha256()
+        with open(download, 'rb') as art_file:
+            for chunk in iter(lambda: art_file.read(65536), b''):
+                digest.update(chunk)
+        image_hash = digest.hexdigest()
+        path = self.get_path(image_hash)
+        if os.path.isfile(path):
+            # the same image is already cached for another object
+            os.remove(download)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(download, path)
+        with self.lock, self.connection:
+            self.connection.execute('INSERT OR IGNORE INTO image (hash, size, last_used) VALUES (?, ?, ?)',
+                                    (image_hash, os.path.getsize(path), time.time()))
+            self.connection.execute('INSERT OR REPLACE INTO art (object_type, object_id, hash) VALUES (?, ?, ?)',
+                                    (object_type, object_id, image_hash))
+        self.evict(image_hash)
+        return image_hash
+
+    def get_thumbnail(self, image_hash: str, size: int):
+        """ return a scaled copy of an image, falling back to the original without GdkPixbuf """
+        path = self.get_path(image_hash, size)
+        if os.path.isfile(path):
+            return path
+        if not GdkPixbuf:
+            return self.get_path(image_hash)
+        try:
+            pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_scale(self.get_path(image_hash), size, size, True)
+            pixbuf.savev(path, 'png', [], [])
+        except GLib.Error:
+            return self.get_path(image_hash)
+        with self.lock, self.connection:
+            self.connection.execute('UPDATE image SET size = size + ? WHERE hash = ?',
+                                    (os.path.getsize(path), image_hash))
+        self.evict(image_hash)
+        return path
+
+    def evict(self, keep: str = ''):
+        """ remove the least recently used images (and their thumbnails) until the cache fits max_bytes """
+        with self.lock, self.connection:
+            total = self.connection.execute('SELECT COALESCE(SUM(size), 0) FROM image').fetchone()[0]
+            rows = self.connection.execute('SELECT hash, size FROM image ORDER BY last_used').fetchall()
+            for image_hash, size in rows:
+                if total <= self.max_bytes:
+                    break
+                if image_hash == keep:
+                    continue
+                folder = os.path.dirname(self.get_path(image_hash))
+                try:
+                    for name in os.listdir(folder):
+                        if name.startswith(image_hash):
+                            os.remove(os.path.join(folder, name))
+                except OSError:
+                    # already removed outside the cache, the rows still have to go
+                    pass
+                self.connection.execute('DELETE FROM image WHERE hash = ?', (image_hash,))
+                self.connection.execute('DELETE FROM art WHERE hash = ?', (image_hash,))
+                total -= size
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
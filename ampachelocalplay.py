@@ -21,23 +21,34 @@
 """
 
 import ampache
+import ampachelibrary
 import configparser
 import gi
 import os
+import queue
+import threading
 import time
 
 gi.require_version('Peas', '1.0')
 gi.require_version('PeasGtk', '1.0')
 
-from gi.repository import GObject, Peas, PeasGtk, Gio, Gtk
-from xdg.BaseDirectory import xdg_config_dirs
+from gi.repository import GLib, GObject, Peas, PeasGtk, Gio, Gtk
+from xdg.BaseDirectory import xdg_cache_home, xdg_config_dirs
 
 _here = os.path.abspath(os.path.dirname(__file__))
 HOMEFOLDER = os.getenv('HOME')
 PLUGIN_PATH = '/ampache-localplay/'
 CONFIGFILE = xdg_config_dirs[0] + PLUGIN_PATH + 'alp.conf'
+LIBRARYFILE = xdg_cache_home + PLUGIN_PATH + 'library.db'
 UIFILE = os.path.join(_here, 'main.ui')
 C = 'conf'
+# renew the session when it is this close (in seconds) to expiring
+SESSION_MARGIN = 300
+SESSION_CHECK = 60
+# tracks added by each enqueue job before button presses get a turn on the worker
+ENQUEUE_BATCH = 25
+# seconds to wait for the request in progress when closing
+QUIT_TIMEOUT = 2
 
 
 def run_events():
@@ -45,6 +56,43 @@ def run_events():
         Gtk.main_iteration()
 
 
+class RequestWorker(object):
+    """ Run network requests in order on one thread and hand the results back to the GTK main loop """
+
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.run, name='ampache-worker', daemon=True)
+        self.thread.start()
+
+    def submit(self, job, callback=None, *args):
+        """ queue job(*args) and call callback(result) from the main loop when it finishes """
+        self.queue.put((job, callback, args))
+
+    def run(self):
+        while True:
+            job, callback, args = self.queue.get()
+            if job is None:
+                return
+            try:
+                result = job(*args)
+            except Exception as error:
+                # keep the worker alive so later requests still run
+                print('request failed: ' + str(error))
+                result = False
+            if callback:
+                GLib.idle_add(callback, result)
+
+    def stop(self, timeout: float = None):
+        """ drop the jobs that haven't started and wait up to timeout seconds for the current one """
+        try:
+            while True:
+                self.queue.get_nowait()
+        except queue.Empty:
+            pass
+        self.queue.put((None, None, ()))
+        self.thread.join(timeout)
+
+
 class AmpacheLocalplay(GObject.Object, Peas.Activatable, PeasGtk.Configurable):
     __gtype_name__ = 'ampache-localplay'
     object = GObject.Property(type=GObject.Object)
@@ -53,6 +101,7 @@ class AmpacheLocalplay(GObject.Object, Peas.Activatable, PeasGtk.Configurable):
         GObject.Object.__init__(self)
         self.ampache = ampache.API()
         self.ampache.set_format('json')
+        self.library = ampachelibrary.LibraryStore(self.ampache, LIBRARYFILE)
         self.plugin_info = 'ampache-localplay'
         self.conf = configparser.RawConfigParser()
         self.configfile = CONFIGFILE
@@ -81,6 +130,16 @@ class AmpacheLocalplay(GObject.Object, Peas.Activatable, PeasGtk.Configurable):
         self.ampache_apikey = None
         self.ampache_password = None
         self.ampache_session = False
+        self.enqueue_id = 0
+        self.worker = RequestWorker()
+        # clicks waiting to be sent, merged into one job per burst
+        self.pending_lock = threading.Lock()
+        self.pending_volume = 0
+        self.pending_skip = 0
+        self.volume_queued = False
+        self.skip_queued = False
+        self.status_queued = False
+        self.status_state = False
         self.do_activate()
 
     def do_activate(self):
@@ -100,10 +159,6 @@ class AmpacheLocalplay(GObject.Object, Peas.Activatable, PeasGtk.Configurable):
 
     def ampache_auth(self, key):
         """ ping ampache for auth key """
-        self.ampache_user = self.conf.get(C, 'ampache_user')
-        self.ampache_url = self.conf.get(C, 'ampache_url')
-        self.ampache_apikey = self.conf.get(C, 'ampache_api')
-        self.ampache_password = self.conf.get(C, 'ampache_password')
         if self.ampache_url[:8] == 'https://' or self.ampache_url[:7] == 'http://':
             if key:
                 ping = self.ampache.ping(self.ampache_url, key)
@@ -113,7 +168,7 @@ class AmpacheLocalplay(GObject.Object, Peas.Activatable, PeasGtk.Configurable):
                     if not self.ampache.AMPACHE_SESSION:
                         self.ampache.AMPACHE_SESSION = self.ampache_session
                     # ping successful
-                    self.update_status('ping')
+                    GLib.idle_add(self.update_status, 'ping')
                     self.ampache_session = ping
                     return ping
             if self.ampache_password:
@@ -123,7 +178,7 @@ class AmpacheLocalplay(GObject.Object, Peas.Activatable, PeasGtk.Configurable):
             else:
                 auth = self.ampache.handshake(self.ampache_url, self.ampache.encrypt_string(self.ampache_apikey, self.ampache_user))
             if auth:
-                self.update_status('handshake')
+                GLib.idle_add(self.update_status, 'handshake')
                 print('handshake successful')
                 if not self.ampache.AMPACHE_URL:
                     self.ampache.AMPACHE_URL = self.ampache_url
@@ -156,6 +211,14 @@ class AmpacheLocalplay(GObject.Object, Peas.Activatable, PeasGtk.Configurable):
             self.conf.write(datafile)
             datafile.close()
             self.conf.read(self.configfile)
+        self.ampache_user = self.conf.get(C, 'ampache_user')
+        self.ampache_url = self.conf.get(C, 'ampache_url')
+        self.ampache_apikey = self.conf.get(C, 'ampache_api')
+        self.ampache_password = self.conf.get(C, 'ampache_password')
+        # optional: record the session for ampachereplay.py e.g. ampache_trace = ~/alp.trace.gz
+        trace = self.conf.get(C, 'ampache_trace', fallback='')
+        if trace and not self.ampache.AMPACHE_TRACE:
+            self.ampache.set_trace(os.path.expanduser(trace))
         return
 
     def do_create_main_window(self):
@@ -192,6 +255,7 @@ class AmpacheLocalplay(GObject.Object, Peas.Activatable, PeasGtk.Configurable):
         self.playlistcombo.add_attribute(cell, 'text', 1)
         self.getplaylists()
         self.localplay_status()
+        GLib.timeout_add_seconds(SESSION_CHECK, self._renew_session)
 
         # check for config file and info
         self.window.show_all()
@@ -216,6 +280,12 @@ class AmpacheLocalplay(GObject.Object, Peas.Activatable, PeasGtk.Configurable):
 
     def quit(self, *args):
         """ stop the process thread and close the program"""
+        # stop queueing tracks and let the request in progress finish before the store and pool close
+        self.enqueue_id += 1
+        self.worker.stop(QUIT_TIMEOUT)
+        self.library.close()
+        self.ampache.close_pool()
+        self.ampache.set_trace()
         self.window.destroy()
         Gtk.main_quit(*args)
         return False
@@ -228,7 +298,6 @@ class AmpacheLocalplay(GObject.Object, Peas.Activatable, PeasGtk.Configurable):
         self.tracklabel.set_text(self.track + joinstring + self.total_tracks + ' - ' + self.track_title + ' - ' + self.track_album + ' - ' + self.track_artist)
         self.statelabel.set_text(self.state)
         self.volumelabel.set_text(str(int(self.volume * 100)) + '%')
-        run_events()
 
     def save_config(self, builder):
         """ Save changes to the plugin config """
@@ -244,8 +313,8 @@ class AmpacheLocalplay(GObject.Object, Peas.Activatable, PeasGtk.Configurable):
         self.conf.write(datafile)
         datafile.close()
         self.set_status('Config Saved')
-        # Get a session
-        self.ampache_auth(self.ampache_session)
+        # Get a new session, the user or server may have changed
+        self.worker.submit(self.ampache_auth, None, False)
 
     def playlistchanged(self, *args):
         """ traverse folders on double click """
@@ -256,77 +325,206 @@ class AmpacheLocalplay(GObject.Object, Peas.Activatable, PeasGtk.Configurable):
             return False
 
     def getplaylists(self):
-        if self._check_session():
+        # show the stored playlists straight away and refresh them in the background
+        self._show_playlists(self._get_stored_playlists())
+        self.worker.submit(self._get_playlists, self._show_playlists)
+
+    def _get_stored_playlists(self):
+        return [[str(child['id']), child['name']] for child in self.library.get_all('playlist')]
+
+    def _get_playlists(self):
+        """ sync the stored playlists (worker thread) """
+        if not self._check_session():
+            return False
+        print("refresh playlists")
+        try:
+            self.library.sync(('playlist',))
+        except ampache.PageError as error:
+            if error.error not in ampache.AUTH_ERRORS:
+                raise
+            # the server rejected the session, get a new one and try once more
+            self.ampache_session = False
+            if not self.ampache_auth(False):
+                return False
+            self.library.sync(('playlist',))
+        return self._get_stored_playlists()
+
+    def _show_playlists(self, playlists):
+        if playlists is not False:
             self.playlistlist.clear()
-            print("refresh playlists")
-            status = self.ampache.playlists(False, False, 0, 0)
-            for child in status['playlist']:
-                self.playlistlist.append([child['id'], child['name']])
+            for playlist in playlists:
+                self.playlistlist.append(playlist)
             self.localplay_status('refresh')
 
     def _check_session(self):
+        """ only go to the server when the session is missing or about to expire """
+        if self.ampache_session and self.ampache.AMPACHE_SESSION_EXPIRE - time.time() > SESSION_MARGIN:
+            return self.ampache_session
         return self.ampache_auth(self.ampache_session)
 
+    def _renew_session(self):
+        """ extend the session before a button press has to wait for it """
+        if self.ampache_session and self.ampache.AMPACHE_SESSION_EXPIRE - time.time() < SESSION_MARGIN * 2:
+            self.worker.submit(self.ampache_auth, None, self.ampache_session)
+        return True
+
+    def _request(self, method, *args):
+        """ run an api call, getting a new session and retrying once if the server rejected it """
+        result = method(*args)
+        if self.ampache.is_auth_error(result):
+            self.ampache_session = False
+            if self.ampache_auth(False):
+                result = method(*args)
+        return result
+
+    def _command(self, command):
+        """ send a localplay command and return the new status (worker thread) """
+        if not self._check_session():
+            return False
+        self._request(self.ampache.localplay, command)
+        return self._get_status()
+
     def delete_all(self):
-        if self._check_session():
-            self.ampache.localplay('delete_all')
+        # stop any playlist that is still being queued
+        self.enqueue_id += 1
+        self.worker.submit(self._delete_all, self._show_delete_all)
+
+    def _delete_all(self):
+        if not self._check_session():
+            return False
+        return self._request(self.ampache.localplay, 'delete_all')
+
+    def _show_delete_all(self, result):
+        if result is not False:
             self.update_status('delete_all')
             self.tracklabel.set_text('0/0 -  -  - ')
 
     def play_now(self):
-        if self._check_session():
-            listid = self.playlistchanged()
-            if not listid:
+        listid = self.playlistchanged()
+        if not listid:
+            return False
+        self.enqueue_id += 1
+        self.worker.submit(self._play_now, lambda status: self._show_status(status, 'play'), listid, self.enqueue_id)
+
+    def _play_now(self, listid, enqueue_id):
+        """ replace the queue with a playlist and start playing (worker thread) """
+        if not self._check_session():
+            return False
+        songs = self.ampache.iter_playlist_songs(listid)
+        first = next(songs, False)
+        self._request(self.ampache.localplay, 'delete_all')
+        if not first:
+            return self._get_status()
+        # start playing as soon as the first track is queued
+        self._request(self.ampache.localplay, 'add', first['id'], 'song', 0)
+        self._request(self.ampache.localplay, 'play')
+        self.worker.submit(self._enqueue, None, songs, enqueue_id)
+        return self._get_status()
+
+    def _enqueue(self, songs, enqueue_id):
+        """ add the next batch of tracks then queue the rest behind any other requests (worker thread) """
+        for count in range(ENQUEUE_BATCH):
+            # delete_all and play_now change enqueue_id before their own jobs are queued
+            if enqueue_id != self.enqueue_id:
+                songs.close()
+                return False
+            child = next(songs, False)
+            if not child:
+                self.localplay_status('play')
+                return count
+            result = self._request(self.ampache.localplay, 'add', child['id'], 'song', 0)
+            if not result or self.ampache.get_error_code(result):
+                songs.close()
                 return False
-            status = self.ampache.playlist_songs(listid, 0, 0)
-            songs = []
-            for child in status['song']:
-                songs.append(child['id'])
-            self.delete_all()
-            count = 0
-            for song_id in songs:
-                self.ampache.localplay('add', song_id, 'song', 0)
-                if count == 0:
-                    self.localplay_play()
-                    count = 1
-            self.localplay_status('play')
+        self.worker.submit(self._enqueue, None, songs, enqueue_id)
+        return ENQUEUE_BATCH
 
     def localplay_previous(self):
-        if self._check_session():
-            self.ampache.localplay('previous')
-            self.localplay_status('previous')
+        self._queue_skip(-1)
 
     def localplay_stop(self):
-        if not self.state == 'stop' and self._check_session():
-            self.ampache.localplay('stop')
-            self.localplay_status('stop')
+        if not self.state == 'stop':
+            self.worker.submit(self._command, lambda status: self._show_status(status, 'stop'), 'stop')
 
     def localplay_pause(self):
-        if not self.state == 'pause' and self._check_session():
-            self.ampache.localplay('pause')
-            self.localplay_status('pause')
+        if not self.state == 'pause':
+            self.worker.submit(self._command, lambda status: self._show_status(status, 'pause'), 'pause')
 
     def localplay_play(self):
-        if not self.state == 'play' and self._check_session():
-            self.ampache.localplay('play')
-            self.localplay_status('play')
+        if not self.state == 'play':
+            self.worker.submit(self._command, lambda status: self._show_status(status, 'play'), 'play')
 
     def localplay_next(self):
-        if self._check_session():
-            self.ampache.localplay('next')
-            self.localplay_status('next')
+        self._queue_skip(1)
+
+    def _queue_skip(self, step: int):
+        """ add a next (1) or previous (-1) to the pending skip """
+        with self.pending_lock:
+            self.pending_skip += step
+            if self.skip_queued:
+                return
+            self.skip_queued = True
+        self.worker.submit(self._skip)
+
+    def _skip(self):
+        """ send the net skip for every click since the last one was sent (worker thread) """
+        with self.pending_lock:
+            steps = self.pending_skip
+            self.pending_skip = 0
+            self.skip_queued = False
+        if not steps or not self._check_session():
+            return False
+        if abs(steps) == 1:
+            command = 'next' if steps > 0 else 'prev'
+            self._request(self.ampache.localplay, command)
+        else:
+            # one skip to the track the clicks add up to, skip counts from 0 and the status from 1
+            result = self._get_status()
+            if not result or not result[0].track:
+                return False
+            status, total_tracks = result
+            target = status.track - 1 + steps
+            if total_tracks:
+                target = min(target, int(total_tracks) - 1)
+            target = max(target, 0)
+            command = 'skip'
+            self._request(self.ampache.localplay, command, target)
+        self.localplay_status(command)
+        return steps
 
     def localplay_volume_up(self):
-        if self.volume < 1.00 and self._check_session():
-            self.ampache.localplay('volume_up')
-            self.volume = round(self.volume + .05, 2)
+        if self.volume < 1.00:
+            self.volume = min(round(self.volume + .05, 2), 1.00)
             self.update_status('volume_up')
+            self._queue_volume(1)
 
     def localplay_volume_down(self):
-        if self.volume > 0.00 and self._check_session():
-            self.ampache.localplay('volume_down')
-            self.volume = round(self.volume - .05, 2)
+        if self.volume > 0.00:
+            self.volume = max(round(self.volume - .05, 2), 0.00)
             self.update_status('volume_down')
+            self._queue_volume(-1)
+
+    def _queue_volume(self, step: int):
+        """ add a volume up (1) or down (-1) to the pending change """
+        with self.pending_lock:
+            self.pending_volume += step
+            if self.volume_queued:
+                return
+            self.volume_queued = True
+        self.worker.submit(self._volume)
+
+    def _volume(self):
+        """ send the net volume change for every click since the last one was sent (worker thread) """
+        with self.pending_lock:
+            steps = self.pending_volume
+            self.pending_volume = 0
+            self.volume_queued = False
+        if not steps or not self._check_session():
+            return False
+        command = 'volume_up' if steps > 0 else 'volume_down'
+        for _ in range(abs(steps)):
+            self._request(self.ampache.localplay, command)
+        return steps
 
     def update_status(self, state: str = False):
         if not state:
@@ -334,53 +532,54 @@ class AmpacheLocalplay(GObject.Object, Peas.Activatable, PeasGtk.Configurable):
         self.set_status(state)
 
     def localplay_status(self, state: str = False):
-        if self._check_session():
-            self.track_title = ''
-            self.track_artist = ''
-            self.track_album = ''
-            status = self.ampache.localplay('status')
-            self.state = status['localplay']['command']['status']['state']
-            self.volume = float(int(status['localplay']['command']['status']['volume']) / 100)
-            self.repeat = status['localplay']['command']['status']['repeat']
-            self.random = status['localplay']['command']['status']['random']
-            try:
-                songs = self.ampache.localplay_songs()['localplay_songs']
-                self.total_tracks = str(len(songs))
-            except KeyError:
-                self.total_tracks = ''
-            if self.total_tracks == '0':
-                self.track = '0'
-            else:
-                try:
-                    if status['localplay']['command']['status']['track']:
-                        self.track = str(status['localplay']['command']['status']['track'])
-                except IndexError:
-                    self.track = ''
-                except KeyError:
-                    self.track = ''
-            try:
-                if status['localplay']['command']['status']['track_title']:
-                    self.track_title = status['localplay']['command']['status']['track_title']
-            except IndexError:
-                self.track_title = ''
-            except KeyError:
-                self.track_title = ''
-            try:
-                if status['localplay']['command']['status']['track_artist']:
-                    self.track_artist = status['localplay']['command']['status']['track_artist']
-            except IndexError:
-                self.track_artist = ''
-            except KeyError:
-                self.track_artist = ''
-            try:
-                if status['localplay']['command']['status']['track_album']:
-                    self.track_album = status['localplay']['command']['status']['track_album']
-            except IndexError:
-                self.track_album = ''
-            except KeyError:
-                self.track_album = ''
-            self.update_status(state)
-
+        """ refresh the status, unless a refresh is already waiting to run (any thread) """
+        with self.pending_lock:
+            self.status_state = state
+            if self.status_queued:
+                return
+            self.status_queued = True
+        self.worker.submit(self._refresh_status, self._show_refresh)
+
+    def _refresh_status(self):
+        with self.pending_lock:
+            self.status_queued = False
+            state = self.status_state
+        return self._get_status(), state
+
+    def _show_refresh(self, result):
+        if result:
+            self._show_status(*result)
+
+    def _get_status(self):
+        """ fetch the localplay status and queue length (worker thread) """
+        if not self._check_session():
+            return False
+        status = ampache.LocalplayStatus.from_response(self._request(self.ampache.localplay, 'status'))
+        if not status:
+            return False
+        try:
+            songs = self._request(self.ampache.localplay_songs)['localplay_songs']
+            total_tracks = str(len(songs))
+        except (KeyError, TypeError):
+            total_tracks = ''
+        return status, total_tracks
+
+    def _show_status(self, result, state: str = False):
+        if not result:
+            return False
+        status, self.total_tracks = result
+        self.state = status.state
+        self.volume = float(status.volume / 100)
+        self.repeat = status.repeat
+        self.random = status.random
+        if self.total_tracks == '0':
+            self.track = '0'
+        elif status.track:
+            self.track = str(status.track)
+        self.track_title = status.track_title
+        self.track_artist = status.track_artist
+        self.track_album = status.track_album
+        self.update_status(state)
 
 if __name__ == "__main__":
     AmpacheLocalplay()
@@ -0,0 +1,441 @@
+#!/usr/bin/env python3
+
+"""    Copyright (C)2021
+       Lachlan de Waard <lachlan.00@gmail.com>
+       ------------------------------------------------
+       ampache-localplay: local stand-in Ampache server
+       ------------------------------------------------
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+ Serve a generated library on /server/json.server.php and /server/xml.server.php
+ so ampache.API can be measured without a live Ampache instance.
+
+ e.g. python3 ampachemock.py --port 8080 --songs 100000 --latency 0.02 --error-rate 0.01
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+import urllib.parse
+
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from xml.sax.saxutils import escape, quoteattr
+
+# songs on each album and albums for each artist
+ALBUM_SONGS = 10
+ARTIST_ALBUMS = 10
+GENRES = 20
+# rendered pages kept so repeated requests measure the client instead of the mock
+PAGE_CACHE = 32
+LOCALPLAY_COMMANDS = ('add', 'delete_all', 'play', 'stop', 'pause', 'next', 'prev', 'skip',
+                      'volume_up', 'volume_down', 'volume_mute')
+
+
+class MockLibrary(object):
+    """ Generate artists, albums, songs and playlists on demand from their id """
+
+    def __init__(self, songs: int = 10000, playlists: int = 10, playlist_size: int = 1000, text_size: int = 0,
+                 deleted_songs: int = 10):
+        self.songs = songs
+        self.albums = max(1, -(-songs // ALBUM_SONGS))
+        self.artists = max(1, -(-self.albums // ARTIST_ALBUMS))
+        self.playlists = playlists
+        self.playlist_size = playlist_size
+        self.deleted_songs = deleted_songs
+        self.created = int(time.time())
+        # pad names to make larger responses
+        self.padding = ' ' + 'x' * text_size if text_size else ''
+
+    def count(self, object_type: str):
+        return getattr(self, object_type + 's')
+
+    def get_genre(self, number: int):
+        genre_id = number % GENRES + 1
+        return [{'id': str(genre_id), 'name': 'Genre ' + str(genre_id)}]
+
+    def get_artist(self, artist_id: int):
+        albums = min(ARTIST_ALBUMS, self.albums - (artist_id - 1) * ARTIST_ALBUMS)
+        return {'id': str(artist_id), 'name': 'Artist ' + str(artist_id) + self.padding,
+                'albumcount': albums, 'songcount': albums * ALBUM_SONGS, 'time': albums * ALBUM_SONGS * 200,
+                'rating': artist_id % 6, 'genre': self.get_genre(artist_id)}
+
+    def get_album(self, album_id: int):
+        artist_id = (album_id - 1) // ARTIST_ALBUMS + 1
+        songs = min(ALBUM_SONGS, self.songs - (album_id - 1) * ALBUM_SONGS)
+        return {'id': str(album_id), 'name': 'Album ' + str(album_id) + self.padding,
+                'artist': {'id': str(artist_id), 'name': 'Artist ' + str(artist_id) + self.padding},
+                'year': 1960 + album_id % 60, 'songcount': songs, 'time': songs * 200,
+                'rating': album_id % 6, 'genre': self.get_genre(artist_id)}
+
+    def get_song(self, song_id: int):
+        album_id = (song_id - 1) // ALBUM_SONGS + 1
+        artist_id = (album_id - 1) // ARTIST_ALBUMS + 1
+        return {'id': str(song_id), 'title': 'Song ' + str(song_id) + self.padding,
+                'artist': {'id': str(artist_id), 'name': 'Artist ' + str(artist_id) + self.padding},
+                'album': {'id': str(album_id), 'name': 'Album ' + str(album_id) + self.padding},
+                'genre': self.get_genre(artist_id), 'track': (song_id - 1) % ALBUM_SONGS + 1,
+                'year': 1960 + album_id % 60, 'time': 120 + song_id % 240, 'rating': song_id % 6,
+                'playcount': song_id % 50, 'mime': 'audio/mpeg'}
+
+    def get_playlist(self, playlist_id: int):
+        return {'id': str(playlist_id), 'name': 'Playlist ' + str(playlist_id) + self.padding,
+                'owner': 'admin', 'items': min(self.playlist_size, self.songs), 'type': 'public'}
+
+    def get_deleted_song(self, number: int):
+        """ songs past the end of the library, deleted when the library was created """
+        song = self.get_song(self.songs + number)
+        now = self.created
+        return {'id': song['id'], 'title': song['title'], 'file': '/media/' + song['id'] + '.mp3',
+                'catalog': '1', 'total_count': 0, 'total_skip': 0, 'addition_time': now - 86400,
+                'update_time': now - 86400, 'delete_time': now, 'album': song['album']['id'],
+                'artist': song['artist']['id']}
+
+    def get_object(self, object_type: str, object_id):
+        """ return one object or False when the id doesn't exist """
+        try:
+            object_id = int(object_id)
+        except (TypeError, ValueError):
+            return False
+        if not 0 < object_id <= self.count(object_type):
+            return False
+        return getattr(self, 'get_' + object_type)(object_id)
+
+    def get_ids(self, action: str, filter_id):
+        """ return the ids for a list action as a range or list """
+        try:
+            filter_id = int(filter_id or 0)
+        except ValueError:
+            filter_id = 0
+        if action in ('songs', 'albums', 'artists', 'playlists'):
+            return 'song' if action == 'songs' else action[:-1], range(1, self.count(action[:-1]) + 1)
+        if action == 'playlist_songs':
+            if not 0 < filter_id <= self.playlists:
+                return 'song', range(0)
+            size = min(self.playlist_size, self.songs)
+            return 'song', [(filter_id * 7919 + number) % self.songs + 1 for number in range(size)]
+        if action == 'album_songs':
+            start = (filter_id - 1) * ALBUM_SONGS + 1
+            return 'song', range(max(start, 1), min(start + ALBUM_SONGS, self.songs + 1)) if filter_id > 0 else []
+        if action == 'artist_albums':
+            start = (filter_id - 1) * ARTIST_ALBUMS + 1
+            return 'album', range(max(start, 1), min(start + ARTIST_ALBUMS, self.albums + 1)) if filter_id > 0 else []
+        if action == 'artist_songs':
+            start = (filter_id - 1) * ARTIST_ALBUMS * ALBUM_SONGS + 1
+            end = min(start + ARTIST_ALBUMS * ALBUM_SONGS, self.songs + 1)
+            return 'song', range(max(start, 1), end) if filter_id > 0 else []
+        return False, []
+
+
+def get_xml_object(tag: str, data: dict):
+    """ render an object the way Ampache does, nested objects become <tag id="">name</tag> """
+    parts = ['<' + tag + ' id=' + quoteattr(data['id']) + '>']
+    for key, value in data.items():
+        if key == 'id':
+            continue
+        for item in value if isinstance(value, list) else [value]:
+            if isinstance(item, dict):
+                parts.append('<' + key + ' id=' + quoteattr(item['id']) + '><![CDATA[' + item['name'] + ']]></' +
+                             key + '>')
+            else:
+                parts.append('<' + key + '><![CDATA[' + str(item) + ']]></' + key + '>')
+    parts.append('</' + tag + '>')
+    return ''.join(parts)
+
+
+def get_xml_value(tag: str, value):
+    if isinstance(value, dict):
+        return '<' + tag + '>' + ''.join(get_xml_value(key, item) for key, item in value.items()) + '</' + tag + '>'
+    if isinstance(value, bool):
+        value = int(value)
+    return '<' + tag + '>' + escape(str(value)) + '</' + tag + '>'
+
+
+class MockServer(ThreadingHTTPServer):
+    """ Threaded stand-in Ampache server
+
+        INPUTS
+        * host           = (string) address to listen on //optional
+        * port           = (integer) 0 picks a free port //optional
+        * library        = (MockLibrary) generated objects //optional
+        * latency        = (float) seconds added to every response //optional
+        * jitter         = (float) up to this many extra random seconds //optional
+        * error_rate     = (float) fraction of requests answered with HTTP 503 //optional
+        * api_error_rate = (float) fraction of requests answered with an expired session error //optional
+        * file_size      = (integer) bytes sent by stream, download and get_art //optional
+    """
+    daemon_threads = True
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, library: MockLibrary = None, latency: float = 0,
+                 jitter: float = 0, error_rate: float = 0, api_error_rate: float = 0, file_size: int = 4194304):
+        super().__init__((host, port), MockHandler)
+        self.library = library if library else MockLibrary()
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.api_error_rate = api_error_rate
+        self.file_size = file_size
+        self.file_data = bytes(range(256)) * (file_size // 256) + bytes(file_size % 256)
+        self.sessions = set()
+        self.localplay = {'state': 'stop', 'volume': 50, 'repeat': 0, 'random': 0, 'track': 0, 'queue': []}
+        self.counts = dict()
+        self.pages = OrderedDict()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    @property
+    def url(self):
+        return 'http://' + self.server_address[0] + ':' + str(self.server_address[1])
+
+    def start(self):
+        """ serve from a daemon thread and return the base url for API.handshake """
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self.url
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def get_page(self, key, render):
+        """ return a rendered list response, keeping the last PAGE_CACHE pages """
+        with self.lock:
+            body = self.pages.get(key)
+            if body is not None:
+                self.pages.move_to_end(key)
+                return body
+        body = render()
+        with self.lock:
+            self.pages[key] = body
+            while len(self.pages) > PAGE_CACHE:
+                self.pages.popitem(last=False)
+        return body
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    server_version = 'AmpacheMock/1.0'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        params = dict(urllib.parse.parse_qsl(url.query))
+        action = params.get('action', '')
+        api_format = 'json' if url.path.endswith('/json.server.php') else 'xml'
+        mock = self.server
+        with mock.lock:
+            mock.counts[action] = mock.counts.get(action, 0) + 1
+        if mock.latency or mock.jitter:
+            time.sleep(mock.latency + random.random() * mock.jitter)
+        if not url.path.endswith(('/json.server.php', '/xml.server.php')):
+            return self.send_body(404, b'Not Found', 'text/plain')
+        if mock.error_rate and random.random() < mock.error_rate:
+            return self.send_body(503, b'Service Unavailable', 'text/plain')
+        if action not in ('handshake', 'ping'):
+            if params.get('auth') not in mock.sessions:
+                return self.send_error_response(api_format, action, '4701', 'session', 'Session Expired')
+            if mock.api_error_rate and random.random() < mock.api_error_rate:
+                return self.send_error_response(api_format, action, '4701', 'session', 'Session Expired')
+        if action in ('stream', 'download', 'get_art'):
+            return self.send_file()
+        method = getattr(self, 'action_' + action, None)
+        if method:
+            return method(api_format, params)
+        object_type, ids = mock.library.get_ids(action, params.get('filter'))
+        if object_type:
+            return self.send_list(api_format, action, params, object_type, ids)
+        if action in ('song', 'album', 'artist', 'playlist'):
+            data = mock.library.get_object(action, params.get('filter'))
+            if not data:
+                return self.send_error_response(api_format, action, '4704', 'filter', 'Not Found: ' +
+                                                str(params.get('filter')))
+            if api_format == 'json':
+                return self.send_body(200, json.dumps(data).encode('utf-8'))
+            return self.send_xml(get_xml_object(action, data))
+        return self.send_error_response(api_format, action, '4705', 'action', 'Invalid Request')
+
+    def send_body(self, code: int, body: bytes, content_type: str = '', headers: dict = None):
+        """ send the status, headers and body in one write """
+        lines = ['HTTP/1.1 ' + str(code) + ' ' + self.responses[code][0],
+                 'Server: ' + self.version_string(),
+                 'Date: ' + self.date_time_string(),
+                 'Content-Type: ' + (content_type or 'application/json; charset=utf-8'),
+                 'Content-Length: ' + str(len(body))]
+        for name, value in (headers or dict()).items():
+            lines.append(name + ': ' + value)
+        self.wfile.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body)
+
+    def send_xml(self, xml: str):
+        body = ('<?xml version="1.0" encoding="UTF-8" ?>\n<root>' + xml + '</root>\n').encode('utf-8')
+        self.send_body(200, body, 'text/xml; charset=utf-8')
+
+    def send_data(self, api_format: str, data: dict):
+        """ send a small response, nested dicts become nested xml tags """
+        if api_format == 'json':
+            return self.send_body(200, json.dumps(data).encode('utf-8'))
+        return self.send_xml(''.join(get_xml_value(key, value) for key, value in data.items()))
+
+    def send_error_response(self, api_format: str, action: str, code: str, error_type: str, message: str):
+        if api_format == 'json':
+            return self.send_data(api_format, {'error': {'errorCode': code, 'errorAction': action,
+                                                         'errorType': error_type, 'errorMessage': message}})
+        return self.send_xml('<error errorCode="' + code + '"><errorAction><![CDATA[' + action +
+                             ']]></errorAction><errorType><![CDATA[' + error_type +
+                             ']]></errorType><errorMessage><![CDATA[' + message + ']]></errorMessage></error>')
+
+    def send_list(self, api_format: str, action: str, params: dict, object_type: str, ids, tag: str = ''):
+        """ send a page of objects, tag is the list key/element when it isn't the object type """
+        tag = tag or object_type
+        library = self.server.library
+        offset = int(params.get('offset') or 0)
+        limit = int(params.get('limit') or 0)
+        # nothing changes on the mock so delta requests are always empty
+        if params.get('add') or params.get('update'):
+            ids = range(0)
+        ids = ids[offset:offset + limit] if limit else ids[offset:]
+        key = (api_format, action, params.get('filter'), params.get('add'), params.get('update'), offset, limit)
+
+        def render():
+            objects = (library.get_object(object_type, object_id) for object_id in ids)
+            if api_format == 'json':
+                return json.dumps({tag: list(objects)}).encode('utf-8')
+            return ('<?xml version="1.0" encoding="UTF-8" ?>\n<root><total_count>' + str(len(ids)) +
+                    '</total_count>' + ''.join(get_xml_object(tag, data) for data in objects) +
+                    '</root>\n').encode('utf-8')
+
+        body = self.server.get_page(key, render)
+        self.send_body(200, body, '' if api_format == 'json' else 'text/xml; charset=utf-8')
+
+    def send_file(self):
+        data = self.server.file_data
+        ranges = self.headers.get('Range', '')
+        if ranges.startswith('bytes='):
+            start = int(ranges[6:].split('-')[0] or 0)
+            if start >= len(data):
+                return self.send_body(416, b'', 'text/plain', {'Content-Range': 'bytes */' + str(len(data))})
+            return self.send_body(206, data[start:], 'audio/mpeg',
+                                  {'Content-Range': 'bytes ' + str(start) + '-' + str(len(data) - 1) + '/' +
+                                                    str(len(data))})
+        self.send_body(200, data, 'audio/mpeg')
+
+    def get_session_data(self, session: str):
+        library = self.server.library
+        expire = datetime.now(timezone.utc) + timedelta(hours=1)
+        return {'auth': session, 'api': '5.0.0', 'session_expire': expire.isoformat(timespec='seconds'),
+                'update': '2021-01-01T00:00:00+00:00', 'add': '2021-01-01T00:00:00+00:00',
+                'clean': '2021-01-01T00:00:00+00:00', 'songs': library.songs, 'albums': library.albums,
+                'artists': library.artists, 'playlists': library.playlists, 'podcasts': 0,
+                'podcast_episodes': 0, 'videos': 0, 'catalogs': 1}
+
+    def action_handshake(self, api_format: str, params: dict):
+        session = '%032x' % random.getrandbits(128)
+        with self.server.lock:
+            self.server.sessions.add(session)
+        self.send_data(api_format, self.get_session_data(session))
+
+    def action_ping(self, api_format: str, params: dict):
+        # without a valid session ping only reports the server version
+        if params.get('auth') not in self.server.sessions:
+            return self.send_data(api_format, {'server': self.server_version, 'version': '5.0.0',
+                                               'compatible': '350001'})
+        self.send_data(api_format, self.get_session_data(params['auth']))
+
+    def action_goodbye(self, api_format: str, params: dict):
+        with self.server.lock:
+            self.server.sessions.discard(params['auth'])
+        self.send_data(api_format, {'success': 'goodbye: ' + params['auth']})
+
+    def action_deleted_songs(self, api_format: str, params: dict):
+        self.send_list(api_format, 'deleted_songs', params, 'deleted_song',
+                       range(1, self.server.library.deleted_songs + 1))
+
+    def action_localplay(self, api_format: str, params: dict):
+        command = params.get('command', '')
+        player = self.server.localplay
+        with self.server.lock:
+            if command == 'status':
+                queue = player['queue']
+                song = self.server.library.get_object('song', queue[player['track']] if queue else 0) or dict()
+                status = {'state': player['state'], 'volume': player['volume'], 'repeat': player['repeat'],
+                          'random': player['random'], 'track': player['track'] + 1 if queue else 0,
+                          'track_title': song.get('title', ''),
+                          'track_artist': song.get('artist', dict()).get('name', ''),
+                          'track_album': song.get('album', dict()).get('name', '')}
+                return self.send_data(api_format, {'localplay': {'command': {'status': status}}})
+            if command not in LOCALPLAY_COMMANDS:
+                return self.send_error_response(api_format, 'localplay', '4710', 'command',
+                                                'Bad Request: ' + command)
+            if command == 'add':
+                if params.get('clear') == '1':
+                    player['queue'] = []
+                player['queue'].append(int(params.get('oid') or 0))
+            elif command == 'delete_all':
+                player.update(queue=[], track=0, state='stop')
+            elif command in ('play', 'stop', 'pause'):
+                player['state'] = command
+            elif command == 'skip' and player['queue']:
+                # oid is the queue position from 0, status reports the track from 1
+                player['track'] = min(max(int(params.get('oid') or 0), 0), len(player['queue']) - 1)
+            elif command in ('next', 'prev') and player['queue']:
+                step = -1 if command == 'prev' else 1
+                player['track'] = (player['track'] + step) % len(player['queue'])
+            elif command == 'volume_up':
+                player['volume'] = min(100, player['volume'] + 5)
+            elif command == 'volume_down':
+                player['volume'] = max(0, player['volume'] - 5)
+            elif command == 'volume_mute':
+                player['volume'] = 0
+        self.send_data(api_format, {'localplay': {'command': {command: True}}})
+
+    def action_localplay_songs(self, api_format: str, params: dict):
+        with self.server.lock:
+            queue = list(self.server.localplay['queue'])
+        songs = [{'id': str(song_id), 'name': 'Song ' + str(song_id), 'track': str(track)}
+                 for track, song_id in enumerate(queue, 1)]
+        if api_format == 'json':
+            return self.send_body(200, json.dumps({'localplay_songs': songs}).encode('utf-8'))
+        self.send_xml(''.join(get_xml_object('localplay_songs', song) for song in songs))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve a generated library with the Ampache json and xml api')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--songs', type=int, default=10000)
+    parser.add_argument('--playlists', type=int, default=10)
+    parser.add_argument('--playlist-size', type=int, default=1000)
+    parser.add_argument('--deleted-songs', type=int, default=10, help='songs listed by deleted_songs')
+    parser.add_argument('--text-size', type=int, default=0, help='extra characters added to every name')
+    parser.add_argument('--file-size', type=int, default=4194304, help='bytes sent by stream/download/get_art')
+    parser.add_argument('--latency', type=float, default=0, help='seconds added to every response')
+    parser.add_argument('--jitter', type=float, default=0, help='up to this many extra random seconds')
+    parser.add_argument('--error-rate', type=float, default=0, help='fraction of HTTP 503 responses')
+    parser.add_argument('--api-error-rate', type=float, default=0, help='fraction of expired session errors')
+    args = parser.parse_args()
+    server = MockServer(args.host, args.port,
+                        MockLibrary(args.songs, args.playlists, args.playlist_size, args.text_size, args.deleted_songs),
+                        args.latency, args.jitter, args.error_rate, args.api_error_rate, args.file_size)
+    print('Serving ' + server.url + '/server/json.server.php and ' + server.url + '/server/xml.server.php',
+          flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
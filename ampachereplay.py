@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+
+"""    Copyright (C)2021
+       Lachlan de Waard <lachlan.00@gmail.com>
+       --------------------------------------------
+       ampache-localplay: replay recorded api traces
+       --------------------------------------------
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+ Replay a trace recorded with API.set_trace() against ampachemock.py (or --url)
+ keeping the original timing and threads, and report the client side latency and memory.
+
+ e.g. python3 ampachereplay.py session.trace.gz --speed 10 --songs 100000
+"""
+
+import ampache
+import ampachebench
+import argparse
+import gzip
+import json
+import os
+import resource
+import shutil
+import tempfile
+import threading
+import time
+import tracemalloc
+import urllib.parse
+
+
+def load_trace(path: str):
+    """ return the requests from a trace file in the order they were made """
+    entries = []
+    with gzip.open(path, 'rt', encoding='utf-8') as trace_file:
+        for line in trace_file:
+            entry = json.loads(line)
+            if 'action' in entry:
+                entries.append(entry)
+    entries.sort(key=lambda entry: entry['t'])
+    return entries
+
+
+class Replay(object):
+    """ Send the requests from a trace with one thread for each thread that was recorded """
+
+    def __init__(self, entries, url: str, key: str = 'replay', user: str = False, speed: float = 1,
+                 cache: bool = True, limiter: bool = True):
+        self.entries = entries
+        self.url = url
+        self.key = key
+        self.user = user
+        self.speed = speed
+        self.cache = cache
+        self.limiter = limiter
+        self.apis = dict()
+        self.results = []
+        self.lock = threading.Lock()
+        self.folder = tempfile.mkdtemp(prefix='ampachereplay-')
+
+    def get_api(self, api_format: str):
+        """ return a logged in API for a format, the trace has no credentials so a new session is made """
+        with self.lock:
+            api = self.apis.get(api_format)
+            if api is None:
+                api = ampache.API()
+                api.AMPACHE_API = api_format
+                if not self.cache:
+                    api.set_cache(0)
+                if not self.limiter:
+                    api.set_limiter(False)
+                api.handshake(self.url, self.key, self.user)
+                self.apis[api_format] = api
+            return api
+
+    def send(self, entry: dict):
+        """ make one request the way the client did and return False if it failed """
+        api = self.get_api(entry['format'] or 'json')
+        action = entry['action']
+        if action == 'handshake':
+            return api.handshake(self.url, self.key, self.user)
+        if action == 'ping':
+            return api.ping(self.url, api.AMPACHE_SESSION)
+        params = dict(entry['params'], action=action, auth=api.AMPACHE_SESSION)
+        full_url = (self.url + '/server/' + api.AMPACHE_API + '.server.php?' + urllib.parse.urlencode(params))
+        if entry['kind'] == 'file':
+            return api.fetch_file(full_url, os.path.join(self.folder, str(threading.get_ident())))
+        if entry['kind'] == 'stream':
+            api.stream_state.attribute = entry.get('attribute', action)
+        ampache_response = api.fetch_url(full_url, api.AMPACHE_API, action)
+        if ampache_response is False:
+            return False
+        data = api.return_data(ampache_response)
+        if entry['kind'] == 'stream':
+            return ampachebench.count(data)
+        return data
+
+    def run_thread(self, entries, started: float):
+        for entry in entries:
+            scheduled = started + entry['t'] / self.speed if self.speed else time.perf_counter()
+            wait = scheduled - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+            begin = time.perf_counter()
+            result = self.send(entry)
+            elapsed = time.perf_counter() - begin
+            with self.lock:
+                self.results.append({'action': entry['action'], 'elapsed': elapsed, 'recorded': entry['elapsed'],
+                                     'lag': max(0.0, begin - scheduled), 'ok': result is not False})
+
+    def run(self):
+        """ replay every request and return the wall time in seconds """
+        threads = dict()
+        for entry in self.entries:
+            # goodbye would end the replay session for every request after it
+            if entry['action'] != 'goodbye':
+                threads.setdefault(entry['thread'], []).append(entry)
+        started = time.perf_counter()
+        workers = [threading.Thread(target=self.run_thread, args=(entries, started)) for entries in threads.values()]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return time.perf_counter() - started
+
+    def close(self):
+        for api in self.apis.values():
+            api.close_pool()
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+
+def print_results(results, wall: float, duration: float, peak: int):
+    header = '%-22s %7s %7s %10s %10s %12s' % ('action', 'count', 'errors', 'p50 ms', 'p99 ms', 'recorded p50')
+    print(header)
+    print('-' * len(header))
+    actions = dict()
+    for result in results:
+        actions.setdefault(result['action'], []).append(result)
+    for action in sorted(actions):
+        times = sorted(result['elapsed'] for result in actions[action])
+        recorded = sorted(result['recorded'] for result in actions[action])
+        print('%-22s %7d %7d %10.2f %10.2f %12.2f' % (
+            action, len(times), sum(not result['ok'] for result in actions[action]),
+            ampachebench.get_percentile(times, 50) * 1000, ampachebench.get_percentile(times, 99) * 1000,
+            ampachebench.get_percentile(recorded, 50) * 1000))
+    print()
+    print('requests %d in %.2fs (trace %.2fs), most behind schedule %.0f ms' % (
+        len(results), wall, duration, max([result['lag'] for result in results] or [0]) * 1000))
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print('peak rss %.1f MiB' % (usage / 1024) + (', peak traced %.1f MiB' % (peak / 1048576) if peak else ''))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay an ampache.API trace against a local mock server')
+    parser.add_argument('trace', help='file written by API.set_trace()')
+    parser.add_argument('--url', help='replay against a running server instead of starting ampachemock.py')
+    parser.add_argument('--key', default='replay', help='api key or password for --url')
+    parser.add_argument('--user', default=False, help='username for --url')
+    parser.add_argument('--speed', type=float, default=1, help='2 replays twice as fast, 0 as fast as possible')
+    parser.add_argument('--no-cache', action='store_true', help='turn the response cache off')
+    parser.add_argument('--no-limiter', action='store_true', help='turn the request limiter off')
+    parser.add_argument('--memory', action='store_true', help='trace python allocations (slower)')
+    ampachebench.add_mock_arguments(parser)
+    args = parser.parse_args()
+
+    entries = load_trace(args.trace)
+    if not entries:
+        raise SystemExit('no requests in ' + args.trace)
+    duration = max(entry['t'] + entry['elapsed'] for entry in entries)
+    process = None
+    url = args.url
+    if not url:
+        process, url = ampachebench.start_mock(args)
+    replay = Replay(entries, url, args.key, args.user, args.speed, not args.no_cache, not args.no_limiter)
+    peak = 0
+    try:
+        if args.memory:
+            tracemalloc.start()
+        wall = replay.run()
+        if args.memory:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+    finally:
+        replay.close()
+        if process:
+            process.terminate()
+            process.wait()
+    print_results(replay.results, wall, duration, peak)
+
+
+if __name__ == '__main__':
+    main()